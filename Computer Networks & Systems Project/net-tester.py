@@ -10,6 +10,33 @@ from typing import Optional
 import csv
 from typing import List
 import select
+import selectors
+import ctypes
+import ctypes.util
+import errno
+import os
+import stat
+import multiprocessing
+import tempfile
+import queue
+import mmap
+import math
+import tracemalloc
+import subprocess
+import signal
+import cProfile
+import json
+import heapq
+import http.server
+import socketserver
+from collections import deque
+from array import array
+import asyncio
+
+try:
+    import uvloop   # optional, faster drop-in event loop for --engine asyncio
+except ImportError:
+    uvloop = None
 
 """"
     Usage
@@ -19,6 +46,14 @@ import select
     - Call log_stat() to record individual measurements.
     - Call summary() to print aggregated statistics.
     - Call close() to close any open CSV resource before program exit.
+    - With background=True, log_stat() only queues the record; a writer thread
+      formats, batches and writes CSV rows and console lines, and close()
+      flushes whatever is still queued.
+    - With log_format="bin" the output file holds fixed-width binary records
+      instead of CSV; read it back with read_results().
+    - summary() needs no records in memory; max_stats keeps the latest
+      max_stats of them in self.stats anyway, and compact=True keeps those in
+      a StatStore (arrays) instead of objects.
 
     Example
     -------
@@ -30,6 +65,186 @@ import select
 """
 
 
+# Binary results file: an 8 byte magic then fixed-width little-endian records
+# (timestamp, ip, port, bandwidth Mbps, loss %, jitter ms); missing values are NaN
+BIN_MAGIC = b"NTSTATS1"
+BIN_RECORD = struct.Struct('<d4sH2xddd')
+
+# CSV columns: the common ones, then one group per kind of measurement as
+# (StatRecord field, CSV column, format or None to write the value as is).
+# A run only writes the groups that it can fill (Logger columns=)
+CSV_COMMON = ('ip', 'port', 'timestamp', 'elapsed', 'stream')
+CSV_GROUPS = {
+    "rate": (('bandwidth', 'bandwidth_mbps', '.2f'),
+             ('send_rate', 'send_rate_mbps', '.2f'),
+             ('target_rate', 'target_rate_mbps', '.2f')),
+    "udp": (('loss', 'loss_percent', '.2f'),
+            ('jitter', 'jitter_ms', '.2f'),
+            ('lost', 'lost', None),
+            ('out_of_order', 'out_of_order', None),
+            ('duplicates', 'duplicates', None)),
+    "delay": (('fwd_delay', 'fwd_delay_ms', '.3f'),
+              ('rev_delay', 'rev_delay_ms', '.3f'),
+              ('fwd_jitter', 'fwd_jitter_ms', '.3f'),
+              ('rev_jitter', 'rev_jitter_ms', '.3f'),
+              ('clock_offset', 'clock_offset_ms', '.3f')),
+    "tcp": (('rtt', 'rtt_ms', '.3f'),
+            ('rttvar', 'rttvar_ms', '.3f'),
+            ('cwnd', 'cwnd', None),
+            ('retransmits', 'retransmits', None),
+            ('bytes_acked', 'bytes_acked', None)),
+    "server": (('bytes_received', 'bytes_received', None),
+               ('packets_received', 'packets_received', None),
+               ('loop_latency', 'loop_latency_ms', '.3f')),
+}
+
+
+class StatRecord:
+    """
+    One log_stat() record on its way to the CSV / binary file and console
+    - Fields are read by name; metrics that weren't given are None
+    - The metric fields are exactly those of CSV_GROUPS, so a new metric is
+      one line there (an unknown keyword is a TypeError, never a shifted column)
+    """
+
+    METRICS = tuple(field for group in CSV_GROUPS.values() for field, _, _ in group)
+    __slots__ = ('ip', 'port', 'timestamp', 'elapsed', 'label') + METRICS
+
+    def __init__(self, ip: str, port: int, timestamp: float, elapsed: float,
+                 label: Optional[str], metrics: dict):
+        self.ip = ip
+        self.port = port
+        self.timestamp = timestamp
+        self.elapsed = elapsed
+        self.label = label
+        for field in StatRecord.METRICS:
+            setattr(self, field, metrics.pop(field, None))
+        if metrics:
+            raise TypeError(f"log_stat() got unknown metrics: {', '.join(metrics)}")
+
+
+class StatStore:
+    """
+    Array-backed store for Logger.Stat records (struct of arrays)
+    - One array('d') per column, None kept as NaN, labels only where set,
+      so a record costs ~32 bytes instead of a Python object with a __dict__
+    - With 'maxlen', only the latest records are kept (older halves are
+      dropped in bulk, so appends stay amortised O(1))
+    - Indexing and iteration rebuild Logger.Stat objects on demand
+    """
+
+    def __init__(self, maxlen: Optional[int] = None):
+        self.maxlen = maxlen
+        self.timestamp = array('d')
+        self.bandwidth = array('d')
+        self.loss = array('d')
+        self.jitter = array('d')
+        self.labels = {}        # absolute index -> label, only for labelled records
+        self.dropped = 0        # records discarded by the bound
+
+    def append(self, stat: 'Logger.Stat') -> None:
+        nan = math.nan
+        if stat.label is not None:
+            self.labels[self.dropped + len(self.timestamp)] = stat.label
+        self.timestamp.append(stat.timestamp)
+        self.bandwidth.append(nan if stat.bandwidth is None else stat.bandwidth)
+        self.loss.append(nan if stat.loss is None else stat.loss)
+        self.jitter.append(nan if stat.jitter is None else stat.jitter)
+        if self.maxlen and len(self.timestamp) >= 2 * self.maxlen:
+            drop = len(self.timestamp) - self.maxlen
+            for column in (self.timestamp, self.bandwidth, self.loss, self.jitter):
+                del column[:drop]
+            self.dropped += drop
+            self.labels = {i: l for i, l in self.labels.items() if i >= self.dropped}
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def __getitem__(self, index: int) -> 'Logger.Stat':
+        if index < 0:
+            index += len(self.timestamp)
+        if not 0 <= index < len(self.timestamp):
+            raise IndexError(index)
+
+        def value(column):
+            v = column[index]
+            return None if v != v else v    # NaN -> None
+
+        return Logger.Stat(self.timestamp[index], value(self.bandwidth), value(self.loss),
+                           value(self.jitter), self.labels.get(self.dropped + index))
+
+    def __iter__(self):
+        for index in range(len(self.timestamp)):
+            yield self[index]
+
+
+class QuantileSketch:
+    """
+    Streaming quantile sketch with bounded relative error (DDSketch style)
+    - A value x > 0 is counted in bucket ceil(log(x) / log(gamma)), with
+      gamma = (1 + accuracy) / (1 - accuracy); any quantile read back from the
+      bucket counts is within 'accuracy' (relative) of the true value
+    - Memory is one counter per occupied bucket (a few hundred at most for
+      values spanning 1e-6..1e6 at 1%), never one entry per sample
+    - Exact count / sum / min / max are kept alongside
+    """
+
+    __slots__ = ('gamma', 'log_gamma', 'buckets', 'zeros', 'count', 'total', 'min', 'max')
+
+    ZERO = 1e-9     # values at or below this land in the zero bucket
+
+    def __init__(self, accuracy: float = 0.01):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}   # bucket index -> count
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value <= QuantileSketch.ZERO:
+            self.zeros += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Value at quantile q (0..1), or None if nothing was added"""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q * self.count))    # nearest-rank definition
+        seen = self.zeros
+        if seen >= rank:
+            return max(self.min, 0.0)
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        """Add the samples of 'other' (same accuracy) to this sketch"""
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+
 class Logger:
     """
     Logger
@@ -38,70 +253,283 @@ class Logger:
 
     INFO = '\033[94m[INFO]\033[0m '
     ERROR = '\033[91m[ERROR]\033[0m '
+    SUCCESS = '\033[92m[OK]\033[0m '
+
+    PERCENTILES = (0.5, 0.9, 0.99, 0.999)   # reported by summary()
+    FLUSH_ROWS = 256        # background writer: flush the CSV after this many rows
+    FLUSH_INTERVAL = 0.5    # ... or after this many seconds
+    _STOP = object()        # queue sentinel used by close()
 
     class Stat:
-        """A class to model a single measurement record"""
+        """A class to model a single measurement record (no per-instance __dict__)"""
+
+        __slots__ = ('timestamp', 'label', 'bandwidth', 'loss', 'jitter')
 
         def __init__(self, timestamp: float, bandwidth: Optional[float] = None,
-                     loss: Optional[float] = None, jitter: Optional[float] = None):
+                     loss: Optional[float] = None, jitter: Optional[float] = None,
+                     label: Optional[str] = None):
             self.timestamp = timestamp
+            self.label = label
             self.bandwidth = bandwidth
             self.loss = loss
             self.jitter = jitter
 
-    def __init__(self, csv_output: Optional[str] = "results.csv"):
-        """Initialize Logger with optional CSV output"""
-        self.stats: List[Logger.Stat] = []  # List to store measurements
+    def __init__(self, csv_output: Optional[str] = "results.csv", background: bool = False,
+                 log_format: str = "csv", max_stats: Optional[int] = None,
+                 compact: bool = False, profile_interval: Optional[float] = None,
+                 per_client: bool = True, console: bool = True,
+                 columns: Optional[List[str]] = None):
+        """Initialize Logger with optional CSV (or binary) output and background writer thread
+        - per_client: keep per-client summary sketches (off for --daemon, clients never stop coming)
+        - console: print stat records to stdout (info / error lines always are)
+        - columns: CSV_GROUPS names to write after the common columns (None = all)
+        """
+        # The latest max_stats records (a bounded deque or StatStore), None to keep none
+        self.stats = None
+        if max_stats:
+            self.stats = StatStore(max_stats) if compact else deque(maxlen=max_stats)
+        self.first_timestamp = None         # kept apart, the store may drop old records
+        self.last_timestamp = None          # the latest, --control rows come back dated
+        self.measurements = 0               # records logged, even if the store dropped them
+        # summary() statistics, maintained incrementally in constant memory:
+        # metric name -> QuantileSketch over all clients, and
+        # (ip, port, label) -> metric name -> QuantileSketch per client
+        self.totals = {}
+        self.per_client = {} if per_client else None
+        self.console = console
         self.csv_output = csv_output        # CSV file path or None
         self.csv_file = None               # File handle for CSV
         self.csv_writer = None             # CSV writer object
+        self.bin_file = None               # File handle for binary output
+        self.queue = None                  # records waiting for the writer thread
+        self.writer = None                 # background writer thread
+        # hot-path phase counters (--profile), shared with the test loops
+        self.phases = PhaseCounters(profile_interval) if profile_interval else None
+        self.metrics = None                 # ServerMetrics fed by log_stat (--daemon)
+        # (field, format) of the CSV columns after CSV_COMMON
+        self.columns = [(field, fmt) for name in (columns or CSV_GROUPS)
+                        for field, _, fmt in CSV_GROUPS[name]]
 
         # If the csv parameter is None, then disable CSV output
-        if csv_output:
+        if csv_output and log_format == "bin":
+            self.bin_file = open(csv_output, 'wb')
+            self.bin_file.write(BIN_MAGIC)
+        elif csv_output:
             self.csv_file = open(csv_output, 'w', newline='')
             self.csv_writer = csv.writer(self.csv_file)
             self.csv_writer.writerow(
-                ['timestamp', 'elapsed', 'bandwidth_mbps', 'loss_percent', 'jitter_ms'])
+                list(CSV_COMMON) + [column for name in (columns or CSV_GROUPS)
+                                    for _, column, _ in CSV_GROUPS[name]])
+
+        if background:
+            self.queue = queue.SimpleQueue()
+            self.writer = threading.Thread(target=self._writer_loop, name="logger",
+                                           daemon=True)
+            self.writer.start()
 
-    def log_stat(self, timestamp: float, ip: str, port: int, bandwidth: Optional[float] = None,
-                 loss: Optional[float] = None, jitter: Optional[float] = None) -> None:
+    def log_stat(self, timestamp: float, ip: str, port: int, label: Optional[str] = None,
+                 **metrics) -> None:
         """
-        Log a measurement (all parameters optional)
+        Log a measurement (metrics are keyword arguments, all optional)
         - timestamp: Time of measurement (float)
         - ip: Client IP address (str)
         - port: Client port number (int)
         - bandwidth: Bandwidth in Mbps (float, optional)
         - loss: Packet loss in percent (float, optional)
         - jitter: Jitter in milliseconds (float, optional)
+        - send_rate: Achieved sending rate in Mbps (float, optional)
+        - target_rate: Requested sending rate in Mbps (float, optional)
+        - lost / out_of_order / duplicates: Packet counts for the interval (int, optional)
+        - label: Stream label for parallel tests, e.g. "stream 1" or "SUM" (str, optional)
+        - fwd_delay / rev_delay: One-way delay client->server / server->client in ms (float, optional)
+        - fwd_jitter / rev_jitter: Jitter of each direction in ms (float, optional)
+        - clock_offset: Estimated server minus client clock in ms (float, optional)
+        - rtt / rttvar: TCP smoothed RTT and its variance in ms (float, optional)
+        - cwnd: TCP congestion window in segments (int, optional)
+        - retransmits / bytes_acked: TCP counts for the interval (int, optional)
+        - bytes_received / packets_received: Server counts for the interval (int, optional)
+        - loop_latency: Mean kernel-to-userspace receive delay in ms (float, optional)
         """
-        stat = Logger.Stat(timestamp, bandwidth, loss, jitter)
-        self.stats.append(stat)
+        phases = self.phases
+        if phases is not None:
+            t0 = time.perf_counter_ns()
         elapsed = 0.0
-        if len(self.stats) > 1:
-            elapsed = timestamp - self.stats[0].timestamp
-
-        # Write to CSV if enabled
-        if self.csv_writer:
-            self.csv_writer.writerow([
-                ip, port,
-                timestamp,
-                f"{elapsed:.3f}",
-                f"{bandwidth:.2f}" if bandwidth is not None else "",
-                f"{loss:.2f}" if loss is not None else "",
-                f"{jitter:.2f}" if jitter is not None else ""
-            ])
+        if self.last_timestamp is None or timestamp > self.last_timestamp:
+            self.last_timestamp = timestamp
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+        else:
+            elapsed = timestamp - self.first_timestamp
+        record = StatRecord(ip, port, timestamp, elapsed, label, metrics)
+
+        if self.stats is not None:
+            self.stats.append(Logger.Stat(timestamp, record.bandwidth, record.loss,
+                                          record.jitter, label))
+        self._update_sketches(ip, port, record.bandwidth, record.loss, record.jitter, label)
+        if self.metrics is not None and label is None:
+            self.metrics.add(ip, port, timestamp, bandwidth=record.bandwidth,
+                             loss=record.loss, jitter=record.jitter, lost=record.lost,
+                             nbytes=record.bytes_received, packets=record.packets_received,
+                             loop_latency=record.loop_latency)
+        if self.queue is not None:
+            self.queue.put(record)      # formatted and written by the writer thread
+        else:
+            self._write([record])
+            self._flush()
+        if phases is not None:
+            phases.add(PH_LOG, t0)
+
+    def _update_sketches(self, ip: str, port: int, bandwidth: Optional[float],
+                         loss: Optional[float], jitter: Optional[float],
+                         label: Optional[str]) -> None:
+        """Feed one record into the aggregate and per-client quantile sketches"""
+        self.measurements += 1
+        if label is None:
+            bw_name = "Bandwidth"
+        elif label == "SUM":
+            bw_name = "Aggregate bandwidth (SUM)"
+        elif label == "reverse":
+            bw_name = "Reverse bandwidth"
+        elif label == "SUM reverse":
+            bw_name = "Aggregate reverse bandwidth (SUM)"
+        elif label == "server":
+            bw_name = "Server-side bandwidth"
+        else:
+            bw_name = "Per-stream bandwidth"
+
+        targets = (self.totals,)
+        if self.per_client is not None:
+            client = self.per_client.get((ip, port, label))
+            if client is None:
+                client = self.per_client[(ip, port, label)] = {}
+            targets = (self.totals, client)
+        for name, value in ((bw_name, bandwidth), ("Loss", loss), ("Jitter", jitter)):
+            if value is None:
+                continue
+            for sketches in targets:
+                sketch = sketches.get(name)
+                if sketch is None:
+                    sketch = sketches[name] = QuantileSketch()
+                sketch.add(value)
+
+    def _format(self, record: StatRecord) -> tuple:
+        """Turn a queued stat record into its (CSV row, console line)"""
+        r = record
+        row = [r.ip, r.port, r.timestamp, f"{r.elapsed:.3f}", r.label or ""]
+        for field, fmt in self.columns:
+            value = getattr(r, field)
+            if value is None:
+                row.append("")
+            else:
+                row.append(format(value, fmt) if fmt else value)
+
+        parts = [f"[{int(r.elapsed):03d}s] [Client:{r.ip}:{r.port}]"]
+        if r.label:
+            parts.append(f"[{r.label}]")
+
+        if r.bandwidth is not None:
+            parts.append(f"Bandwidth: {r.bandwidth:.2f} Mbps")
+        if r.loss is not None:
+            parts.append(f"Loss: {r.loss:.2f}%")
+        if r.lost is not None:
+            parts.append(f"(lost {r.lost}, reordered {r.out_of_order or 0}, "
+                         f"dup {r.duplicates or 0})")
+        if r.jitter is not None:
+            parts.append(f"Jitter: {r.jitter:.6f} ms")
+        if r.send_rate is not None:
+            if r.target_rate:
+                parts.append(f"Send rate: {r.send_rate:.2f}/{r.target_rate:.2f} Mbps "
+                             f"({r.send_rate / r.target_rate * 100:.1f}%)")
+            else:
+                parts.append(f"Send rate: {r.send_rate:.2f} Mbps")
+        if r.fwd_delay is not None:
+            parts.append(f"Delay fwd/rev: {r.fwd_delay:.3f}/{r.rev_delay:.3f} ms "
+                         f"(jitter {r.fwd_jitter:.3f}/{r.rev_jitter:.3f} ms, "
+                         f"offset {r.clock_offset:.3f} ms)")
+        if r.rtt is not None:
+            parts.append(f"RTT: {r.rtt:.3f} ms (var {r.rttvar:.3f}) cwnd {r.cwnd}")
+        if r.retransmits is not None:
+            parts.append(f"Retr: {r.retransmits}")
+
+        return row, " ".join(parts)
+
+    def _write(self, records: list) -> None:
+        """Write stat records (StatRecord) and text lines (str) to the CSV / stdout"""
+        rows = []
+        lines = []
+        packed = bytearray()
+        nan = math.nan
+        for record in records:
+            if isinstance(record, str):
+                lines.append(record)
+                continue
+            row, line = self._format(record)
+            rows.append(row)
+            if self.console:
+                lines.append(line)
+            if self.bin_file:
+                try:
+                    raw_ip = socket.inet_aton(record.ip)
+                except OSError:
+                    raw_ip = bytes(4)       # not an IPv4 address
+                packed += BIN_RECORD.pack(
+                    record.timestamp, raw_ip, record.port & 0xFFFF,
+                    nan if record.bandwidth is None else record.bandwidth,
+                    nan if record.loss is None else record.loss,
+                    nan if record.jitter is None else record.jitter)
+
+        # Write to CSV (or the binary file) if enabled
+        if rows and self.csv_writer:
+            self.csv_writer.writerows(rows)
+        if packed:
+            self.bin_file.write(packed)
+        if lines:
+            sys.stdout.write("\n".join(lines) + "\n")
+
+    def _writer_loop(self) -> None:
+        """Background writer: drain the queue in batches, flush on size / time / close"""
+        unflushed = 0
+        last_flush = time.monotonic()
+        while True:
+            try:
+                batch = [self.queue.get(timeout=Logger.FLUSH_INTERVAL)]
+            except queue.Empty:
+                batch = []
+            while len(batch) < Logger.FLUSH_ROWS:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = any(record is Logger._STOP for record in batch)
+            if stop:
+                batch = [record for record in batch if record is not Logger._STOP]
+            if batch:
+                self._write(batch)
+                sys.stdout.flush()
+                unflushed += len(batch)
+
+            now = time.monotonic()
+            if unflushed and (stop or unflushed >= Logger.FLUSH_ROWS or
+                              now - last_flush >= Logger.FLUSH_INTERVAL):
+                self._flush()
+                unflushed = 0
+                last_flush = now
+            if stop:
+                return
+
+    def _flush(self) -> None:
+        if self.csv_file:
             self.csv_file.flush()
+        if self.bin_file:
+            self.bin_file.flush()
 
-        parts = [f"[{int(elapsed):03d}s] [Client:{ip}:{port}]"]
-
-        if bandwidth is not None:
-            parts.append(f"Bandwidth: {bandwidth:.2f} Mbps")
-        if loss is not None:
-            parts.append(f"Loss: {loss:.2f}%")
-        if jitter is not None:
-            parts.append(f"Jitter: {jitter:.6f} ms")
-
-        print(" ".join(parts))
+    def _print(self, text: str) -> None:
+        """Print a console line, in order with the queued stat records"""
+        if self.queue is not None:
+            self.queue.put(text)
+        else:
+            print(text)
 
     def summary(self) -> None:
         """
@@ -112,52 +540,465 @@ class Logger:
            - Average
            - Minimum
            - Maximum
-        4. If CSV output was enabled, print the path to the CSV file
+           - p50 / p90 / p99 / p99.9
+        4. For parallel streams, the aggregate (SUM) and per-stream bandwidth,
+           and the server -> client direction of -R / --bidir tests,
+           and what the server measured when it came back over --control
+        5. The same percentiles per client (ip, port[, stream])
+        6. If CSV output was enabled, print the path to the CSV file
+        Everything comes from the streaming sketches and the first / last
+        timestamps, so it works in constant memory however many records were
+        logged; none are kept for it.
         """
-        if not self.stats:
-            print(f"{Logger.INFO}No statistics recorded")
+        if not self.measurements:
+            self._print(f"{Logger.INFO}No statistics recorded")
             return
 
-        print(f"\n{Logger.INFO}=== Test Summary ===")
-        print(
-            f"  Duration: {int(self.stats[-1].timestamp - self.stats[0].timestamp)}s")
-        print(f"  Measurements: {len(self.stats)}")
-
-        # Calculate averages
-        bw_values = [
-            s.bandwidth for s in self.stats if s.bandwidth is not None]
-        loss_values = [s.loss for s in self.stats if s.loss is not None]
-        jitter_values = [s.jitter for s in self.stats if s.jitter is not None]
-
-        if bw_values:
-            print(f"  Bandwidth: avg={sum(bw_values)/len(bw_values):.2f} Mbps, "
-                  f"min={min(bw_values):.2f}, max={max(bw_values):.2f}")
-        if loss_values:
-            print(f"  Loss: avg={sum(loss_values)/len(loss_values):.2f}%, "
-                  f"min={min(loss_values):.2f}, max={max(loss_values):.2f}")
-        if jitter_values:
-            print(f"  Jitter: avg={sum(jitter_values)/len(jitter_values):.6f} ms, "
-                  f"min={min(jitter_values):.6f}, max={max(jitter_values):.6f}")
+        self._print(f"\n{Logger.INFO}=== Test Summary ===")
+        self._print(
+            f"  Duration: {int(self.last_timestamp - self.first_timestamp)}s")
+        self._print(f"  Measurements: {self.measurements}")
+
+        for name in ("Bandwidth", "Aggregate bandwidth (SUM)", "Per-stream bandwidth",
+                     "Reverse bandwidth", "Aggregate reverse bandwidth (SUM)",
+                     "Server-side bandwidth", "Loss", "Jitter"):
+            sketch = self.totals.get(name)
+            if sketch is not None:
+                self._print(f"  {name}: {Logger._describe(name, sketch)}")
+
+        if self.per_client is not None and len(self.per_client) > 1:
+            self._print("  Per client:")
+            for (ip, port, label), sketches in self.per_client.items():
+                tag = f"{ip}:{port}" + (f" [{label}]" if label else "")
+                for name, sketch in sketches.items():
+                    self._print(f"    {tag} {name}: {Logger._describe(name, sketch)}")
 
         if self.csv_output:
             self.log_success(f"Results saved to {self.csv_output}")
 
+    @staticmethod
+    def _describe(name: str, sketch: QuantileSketch) -> str:
+        """avg / min / max and percentiles of one metric, in its unit"""
+        if name == "Jitter":
+            unit, fmt = " ms", ".6f"
+        elif name == "Loss":
+            unit, fmt = "%", ".2f"
+        else:
+            unit, fmt = " Mbps", ".2f"
+        percentiles = ", ".join(
+            f"p{q * 100:g}={sketch.quantile(q):{fmt}}" for q in Logger.PERCENTILES)
+        return (f"avg={sketch.mean():{fmt}}{unit}, min={sketch.min:{fmt}}, "
+                f"max={sketch.max:{fmt}}, {percentiles}")
+
     def close(self) -> None:
-        """Close CSV file if open"""
+        """Flush the background writer, then close CSV file if open"""
+        if self.writer is not None:
+            self.queue.put(Logger._STOP)
+            self.writer.join()
+            self.writer = None
+            self.queue = None
         if self.csv_file:
             self.csv_file.close()
+        if self.bin_file:
+            self.bin_file.close()
 
     def log_info(self, message: str) -> None:
         """
         Print an info message to stdout
         """
-        print(f"{Logger.INFO}{message}")
+        self._print(f"{Logger.INFO}{message}")
 
     def log_error(self, message: str) -> None:
         """
         Print an info message to stdout
         """
-        print(f"{Logger.ERROR}{message}")
+        self._print(f"{Logger.ERROR}{message}")
+
+    def log_success(self, message: str) -> None:
+        """
+        Print a success message to stdout
+        """
+        self._print(f"{Logger.SUCCESS}{message}")
+
+# ---------------------- Hot-path profiling ----------------------
+
+PH_PACK, PH_SEND, PH_SLEEP, PH_OVERSHOOT, PH_RECV, PH_PROCESS, PH_LOG = range(7)
+
+
+class PhaseCounters:
+    """
+    Per-phase time counters for the send/receive loops (--profile)
+    - add(phase, t0) adds perf_counter_ns() - t0 to a preallocated array slot
+      and returns the new timestamp, so consecutive phases chain
+    - tick(log) reports each phase's share of wall time and mean cost per call
+      through the Logger once per interval, then resets the counters
+    - Phases can overlap: overshoot (time past the pacer deadline) is part of
+      sleep, log is part of process, and a blocking recv includes idle time
+    """
+
+    NAMES = ("pack", "send", "sleep", "overshoot", "recv", "process", "log")
+
+    def __init__(self, interval: float):
+        self.interval_ns = int(interval * 1e9)
+        self.ns = array('q', bytes(8 * len(self.NAMES)))
+        self.calls = array('q', bytes(8 * len(self.NAMES)))
+        self.last_ns = time.perf_counter_ns()
+
+    def add(self, phase: int, t0: int) -> int:
+        now = time.perf_counter_ns()
+        self.ns[phase] += now - t0
+        self.calls[phase] += 1
+        return now
+
+    def record(self, phase: int, ns: int) -> None:
+        self.ns[phase] += ns
+        self.calls[phase] += 1
+
+    def tick(self, log: 'Logger') -> None:
+        """Report and reset if an interval has passed since the last report"""
+        now = time.perf_counter_ns()
+        wall = now - self.last_ns
+        if wall < self.interval_ns:
+            return
+        parts = []
+        for phase, name in enumerate(self.NAMES):
+            calls = self.calls[phase]
+            if calls:
+                parts.append(f"{name} {self.ns[phase] / wall * 100:.1f}% "
+                             f"({self.ns[phase] / calls / 1000:.1f}us x {calls})")
+                self.ns[phase] = 0
+                self.calls[phase] = 0
+        log.log_info("[profile] " + (", ".join(parts) or "idle"))
+        self.last_ns = now
+
+
+def read_results(path: str) -> dict:
+    """
+    Memory-map a binary results file (log_format="bin") and return its columns
+    as NumPy arrays: timestamp, ip (uint32), port, bandwidth, loss, jitter.
+    The arrays are views on the mapping, so nothing is parsed or copied.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise RuntimeError("read_results() needs NumPy (pip install numpy)")
+
+    dtype = np.dtype([('timestamp', '<f8'), ('ip', '>u4'), ('port', '<u2'), ('_pad', 'V2'),
+                      ('bandwidth', '<f8'), ('loss', '<f8'), ('jitter', '<f8')])
+    assert dtype.itemsize == BIN_RECORD.size
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size <= len(BIN_MAGIC):
+            return {name: np.empty(0, dtype[name]) for name in dtype.names if name != '_pad'}
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(BIN_MAGIC)] != BIN_MAGIC:
+        raise ValueError(f"{path} is not a net-tester binary results file")
+
+    count = (len(mapped) - len(BIN_MAGIC)) // BIN_RECORD.size   # ignore a torn last record
+    records = np.frombuffer(mapped, dtype=dtype, count=count, offset=len(BIN_MAGIC))
+    return {name: records[name] for name in dtype.names if name != '_pad'}
+
+# ---------------------- Control channel ----------------------
+
+CTRL_MAGIC = b"NTCTRL01"
+_CTRL = struct.Struct('!8sI')   # magic, length of the JSON body that follows
+CTRL_MAX = 1 << 20      # largest control message accepted
+CTRL_ROWS = 2000        # result rows per message, well under CTRL_MAX
+CTRL_TIMEOUT = 10.0     # seconds a control peer may stay silent (on top of the test)
+CTRL_SETTLE = 2.0       # seconds the server waits for the data flows to end
+# columns of the per-interval rows a server returns, named like log_stat's parameters;
+# the "reverse" ones are the server's own sending side of -R / --bidir
+RESULT_FIELDS = {
+    "udp": ('time', 'bandwidth', 'loss', 'jitter', 'lost', 'out_of_order', 'duplicates'),
+    "tcp": ('time', 'bandwidth'),
+    "udp reverse": ('time', 'send_rate', 'target_rate'),
+    "tcp reverse": ('time', 'bandwidth', 'send_rate', 'rtt', 'rttvar', 'cwnd',
+                    'retransmits', 'bytes_acked'),
+}
+
+
+def ctrl_send(sock: socket.socket, message: dict) -> None:
+    """Send one control message: CTRL_MAGIC, length, compact JSON"""
+    body = json.dumps(message, separators=(',', ':')).encode()
+    sock.sendall(_CTRL.pack(CTRL_MAGIC, len(body)) + body)
+
+
+def ctrl_recv(sock: socket.socket, pending: bytes = b"") -> dict:
+    """Read one control message ('pending': bytes already read off the socket)
+    - Never reads past the end of the message, the next one may follow
+    """
+    data = bytearray(pending)
+    need = _CTRL.size
+    while True:
+        if len(data) >= _CTRL.size:
+            magic, length = _CTRL.unpack_from(data)
+            if magic != CTRL_MAGIC:
+                raise ValueError("not a control message")
+            if length > CTRL_MAX:
+                raise ValueError(f"control message too large ({length} bytes, "
+                                 f"limit {CTRL_MAX})")
+            if len(data) >= _CTRL.size + length:
+                return json.loads(bytes(data[_CTRL.size:_CTRL.size + length]))
+            need = _CTRL.size + length
+        chunk = sock.recv(min(need - len(data), 65536))
+        if not chunk:
+            raise ConnectionError("control connection closed")
+        data += chunk
+
+
+class ControlSession:
+    """One negotiated test on the server: its parameters and results per data flow"""
+
+    __slots__ = ('params', 'start', 'interval', 'expected_interval',
+                 'results', 'reverse', 'flows', 'done')
+
+    def __init__(self, params: dict, interval: float, expected_interval: float,
+                 flows: set):
+        self.params = params
+        self.start = time.time()
+        self.interval = interval
+        self.expected_interval = expected_interval
+        self.results = {}       # flow key -> interval rows, see RESULT_FIELDS
+        self.reverse = {}       # flow index -> rows of our reverse stream on it
+        self.flows = flows      # keys of the data flows still running
+        self.done = threading.Event()
+        if not flows:
+            self.done.set()
+
+
+class ControlChannel:
+    """
+    Server side of the control channel (client --control), one per server
+    - The client connects to the server's port over TCP and sends its test
+      parameters (protocol, rate, duration, packet size, interval, the local
+      ports of its data flows); the reply accepts them, or refuses them with
+      a reason, e.g. when the protocol is not the one the server runs
+    - Data flows from the announced ports are attached to the session when
+      they show up: UDP flows take the client's rate and packet size for the
+      jitter estimate and its report interval, and every flow keeps its rows;
+      so do the server's reverse streams (-R / --bidir) to the announced ports
+    - When the client is done the server waits for its flows to end (at most
+      CTRL_SETTLE) and returns the rows: a header message with the field
+      names and the number of chunks, then the chunks of up to CTRL_ROWS rows
+      each, so a long test never hits CTRL_MAX
+    - UDP servers accept control connections on a TCP socket of their own
+      (listen()); TCP servers hand over connections that start with
+      CTRL_MAGIC (see tcp_hello). Each session is served in its own thread
+    """
+
+    def __init__(self, log: Logger, proto: str, interval: int):
+        self.log = log
+        self.proto = proto
+        self.interval = interval
+        self.flows = {}     # (ip, port) -> ControlSession
+        self.ports = {}     # announced (ip, port) -> (ControlSession, flow index)
+
+    def listen(self, port: int) -> None:
+        """Accept control connections on TCP 'port' in a background thread"""
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            server_socket.bind(("0.0.0.0", port))
+            server_socket.listen()
+        except OSError as e:
+            server_socket.close()
+            self.log.log_error(f"No control channel on TCP port {port}: {e}")
+            return
+        threading.Thread(target=self._accept, args=(server_socket,),
+                         name="control", daemon=True).start()
+
+    def _accept(self, server_socket: socket.socket) -> None:
+        while True:
+            try:
+                sock, _ = server_socket.accept()
+            except OSError as e:
+                self.log.log_error(f"Control channel: {e}")
+                continue
+            self.serve(sock)
+
+    def serve(self, sock: socket.socket, pending: bytes = b"") -> None:
+        """Run a control session on 'sock' in its own thread"""
+        threading.Thread(target=self._session, args=(sock, pending),
+                         name="control", daemon=True).start()
+
+    def attach(self, key, stats) -> Optional[ControlSession]:
+        """Give a new data flow's stats (ClientStats / TcpClientStats) the
+        result list of the session that announced it, and return the session
+        - 'key' is the flow's (ip, port), or its session ID for UDP
+        """
+        session = self.flows.get(key)
+        if session is not None:
+            stats.results = session.results.setdefault(key, [])
+        return session
+
+    def reverse(self, addr: tuple) -> Optional[list]:
+        """The list for the rows of our reverse stream to 'addr', None if no
+        session announced it"""
+        entry = self.ports.get(addr)
+        if entry is None:
+            return None
+        session, index = entry
+        return session.reverse.setdefault(index, [])
+
+    def finished(self, key) -> None:
+        """A data flow ended (UDP ID 0 or idle timeout, TCP close)"""
+        session = self.flows.get(key)
+        if session is not None:
+            session.flows.discard(key)
+            if not session.flows:
+                session.done.set()
+
+    def _check(self, params) -> Optional[str]:
+        """Return why the test parameters are refused, None if they are fine"""
+        if not isinstance(params, dict):
+            return "malformed request"
+        if params.get("proto") != self.proto:
+            return f"the server runs {self.proto.upper()} tests"
+        for key in ("duration", "interval") + (("rate", "length") if self.proto == "udp" else ()):
+            value = params.get(key)
+            if not isinstance(value, (int, float)) or value <= 0:
+                return f"invalid {key}"
+        if self.proto == "udp" and not _HEADER.size <= params["length"] <= UDP_PACKET_SIZE:
+            return f"length must be between {_HEADER.size} and {UDP_PACKET_SIZE}"
+        ports = params.get("ports")
+        if (not isinstance(ports, list) or not 0 < len(ports) <= 128
+                or not all(isinstance(p, int) and 0 < p < 65536 for p in ports)):
+            return "invalid ports"
+        session = params.get("session", 0)
+        if not isinstance(session, int) or not 0 <= session < 1 << 32:
+            return "invalid session"
+        return None
+
+    def _session(self, sock: socket.socket, pending: bytes) -> None:
+        peer = None
+        session = None
+        keys = ()
+        try:
+            sock.settimeout(CTRL_TIMEOUT)
+            peer = sock.getpeername()[:2]
+            params = ctrl_recv(sock, pending)
+            error = self._check(params)
+            if error is not None:
+                self.log.log_error(f"Control session from {peer} refused: {error}")
+                ctrl_send(sock, {"ok": False, "error": error})
+                return
+
+            # UDP flows are checked per datagram, so they can report at the
+            # client's interval; TCP flows share the server's report timer
+            interval = params["interval"] if self.proto == "udp" else self.interval
+            expected = (params["length"] * 8 / (params["rate"] * 1000)
+                        if self.proto == "udp" else 0.0)
+            if self.proto == "udp" and params.get("session"):
+                keys = [params["session"]]  # UDP flows are keyed by session (UdpSessions)
+            else:
+                keys = [(peer[0], port) for port in params["ports"]]
+            # a reverse-only UDP test has no flow towards us that could end
+            receiving = self.proto == "tcp" or params.get("direction") != "reverse"
+            session = ControlSession(params, interval, expected,
+                                     set(keys) if receiving else set())
+            for key in keys:
+                self.flows[key] = session
+            ports = [(peer[0], port) for port in params["ports"]]
+            for index, addr in enumerate(ports):
+                self.ports[addr] = (session, index)
+            ctrl_send(sock, {"ok": True, "interval": interval})
+            self.log.log_info(f"Control session from {peer}: {self.proto.upper()} "
+                              f"for {params['duration']}s, {len(keys)} flow(s)"
+                              + (f" at {params['rate']} Kbps" if self.proto == "udp" else ""))
+
+            sock.settimeout(params["duration"] + CTRL_TIMEOUT)
+            ctrl_recv(sock)     # the client is done
+            session.done.wait(CTRL_SETTLE)
+            flows = [self._rows(session, session.results.get(key, ()))
+                     for key in keys]   # in the order the client announced them
+            reverse = [self._rows(session, session.reverse.get(n, ()))
+                       for n in range(len(ports))]
+            chunks = [(n, kind, rows[i:i + CTRL_ROWS])
+                      for kind, lists in (("forward", flows), ("reverse", reverse))
+                      for n, rows in enumerate(lists)
+                      for i in range(0, len(rows), CTRL_ROWS)]
+            ctrl_send(sock, {"fields": RESULT_FIELDS[self.proto],
+                             "reverse_fields": RESULT_FIELDS[f"{self.proto} reverse"],
+                             "flows": len(flows), "reverse": len(reverse),
+                             "chunks": len(chunks)})
+            for n, kind, rows in chunks:
+                ctrl_send(sock, {"flow": n, "kind": kind, "rows": rows})
+        except (OSError, ValueError) as e:
+            self.log.log_error(f"Control session from {peer} failed: {e}")
+        finally:
+            for key in keys:
+                if self.flows.get(key) is session:
+                    del self.flows[key]
+            for addr, entry in list(self.ports.items()):
+                if entry[0] is session:
+                    del self.ports[addr]
+            sock.close()
+
+    @staticmethod
+    def _rows(session: ControlSession, rows) -> list:
+        """Rows as sent: time relative to the session start, floats rounded"""
+        return [[round(row[0] - session.start, 3)]
+                + [round(v, 6) if isinstance(v, float) else v for v in row[1:]]
+                for row in list(rows)]
+
+
+def control_open(log: Logger, server_ip: str, server_port: int,
+                 params: dict) -> socket.socket:
+    """Client side: negotiate the test described by 'params' with the server
+    - Returns the control socket to pass to control_results() after the test
+    - Raises ConnectionError if the server refuses the test
+    """
+    sock = socket.create_connection((server_ip, server_port), timeout=CTRL_TIMEOUT)
+    try:
+        ctrl_send(sock, params)
+        reply = ctrl_recv(sock)
+    except Exception:
+        sock.close()
+        raise
+    if not reply.get("ok"):
+        sock.close()
+        raise ConnectionError(f"server refused the test: {reply.get('error')}")
+    log.log_info(f"Control channel: test accepted (server reports every "
+                 f"{reply.get('interval')}s)")
+    return sock
+
+
+def control_results(log: Logger, sock: socket.socket, server_ip: str,
+                    server_port: int, start: float) -> None:
+    """Client side: end the test and log the server's per-interval results
+    - Rows are logged like our own records, labelled "server" (or
+      "server stream N" per flow), at 'start' plus the server's offsets
+    - The server's sending side of -R / --bidir is labelled "server reverse"
+      (or "server stream N reverse")
+    """
+    try:
+        sock.settimeout(CTRL_SETTLE + CTRL_TIMEOUT)
+        ctrl_send(sock, {"done": True})
+        reply = ctrl_recv(sock)
+        flows = {"forward": [[] for _ in range(reply.get("flows", 0))],
+                 "reverse": [[] for _ in range(reply.get("reverse", 0))]}
+        for _ in range(reply.get("chunks", 0)):
+            chunk = ctrl_recv(sock)
+            flows[chunk.get("kind", "forward")][chunk["flow"]].extend(chunk["rows"])
+    except (OSError, ValueError, LookupError) as e:
+        log.log_error(f"No results from the server: {e}")
+        return
+    finally:
+        sock.close()
+
+    known = {f for fields in RESULT_FIELDS.values() for f in fields}  # log_stat kwargs only
+    count = 0
+    for kind, fields, suffix in (("forward", reply.get("fields", ()), ""),
+                                 ("reverse", reply.get("reverse_fields", ()), " reverse")):
+        lists = flows[kind]
+        for n, rows in enumerate(lists):
+            label = ("server" if len(lists) == 1 else f"server stream {n + 1}") + suffix
+            for row in rows:
+                values = {f: v for f, v in zip(fields, row) if f in known}
+                log.log_stat(timestamp=start + values.pop('time', 0.0), ip=server_ip,
+                             port=server_port, label=label, **values)
+            count += len(rows)
+    log.log_info(f"Received {count} interval reports from the server")
 
 # Below you can find sample function signatures for the net-tester client and server.
 # You can modify them as needed.
@@ -165,57 +1006,422 @@ class Logger:
 
 # ---------------------- TCP stubs (Task 2) ----------------------
 
+TCP_RECV_BUFFER = 1024 * 1024   # bytes handed to the kernel per TCP read
+
+
+SO_ZEROCOPY = getattr(socket, "SO_ZEROCOPY", 60)             # Linux >= 4.14
+MSG_ZEROCOPY = getattr(socket, "MSG_ZEROCOPY", 0x4000000)
+TCP_SEND_BURST = 16     # sends per writable event before going back to the selector
+
+TCP_INFO = getattr(socket, "TCP_INFO", 11)      # Linux
+# struct tcp_info from tcpi_rtt (offset 68) to tcpi_bytes_acked (offset 120):
+# rtt, rttvar, snd_ssthresh, snd_cwnd, advmss, reordering, rcv_rtt, rcv_space,
+# total_retrans, then pacing_rate, max_pacing_rate, bytes_acked
+_TCPI = struct.Struct('=9I3Q')
+_TCPI_OFFSET = 68
+_TCPI_LEN = _TCPI_OFFSET + _TCPI.size
+
+
+# -R / --bidir: the client opens with a hello naming the direction(s) of data
+DIRECTIONS = {"forward": 0, "reverse": 1, "bidir": 2}
+TCP_MAGIC = b"NTHELLO1"
+_TCP_HELLO = struct.Struct('!8sB3xI')   # magic, direction, chunk length
+
+
+def tcp_info(sock: socket.socket) -> Optional[tuple]:
+    """Sample TCP_INFO: (rtt_us, rttvar_us, snd_cwnd, total_retrans, bytes_acked)
+    - One getsockopt and one unpack, cheap enough for every interval
+    - bytes_acked is None before Linux 4.1; None overall if TCP_INFO is missing
+    """
+    try:
+        raw = sock.getsockopt(socket.IPPROTO_TCP, TCP_INFO, _TCPI_LEN)
+    except OSError:
+        return None
+    if len(raw) < _TCPI_LEN:
+        if len(raw) < _TCPI_OFFSET + 9 * 4:
+            return None
+        raw = raw.ljust(_TCPI_LEN, b"\0")
+        info = _TCPI.unpack_from(raw, _TCPI_OFFSET)
+        return info[0], info[1], info[3], info[8], None
+    info = _TCPI.unpack_from(raw, _TCPI_OFFSET)
+    return info[0], info[1], info[3], info[8], info[11]
+
+
+class TcpTransmitter:
+    """
+    Sends 'length' byte chunks on non-blocking TCP sockets for the client
+    - mode None: socket.send() from one preallocated buffer
+    - mode "sendfile": os.sendfile() from a memory-backed file (memfd), so the
+      payload is never copied through user space
+    - mode "msg": send() with MSG_ZEROCOPY (SO_ZEROCOPY sockets), the kernel
+      pins the buffer instead of copying it; completion notifications are
+      drained from the error queue so they don't exhaust optmem
+    """
+
+    def __init__(self, log: Logger, length: int, mode: Optional[str] = None):
+        self.log = log
+        self.length = length
+        self.mode = mode
+        self.data = memoryview(b"X" * length)  # creating message
+        self.file = None
+        self.sends = 0
+        if mode == "sendfile":
+            self._use_sendfile()
+
+    def _use_sendfile(self) -> None:
+        """Switch to sendfile mode: put the payload in a file (memfd if available)
+        - Only touches mode and file, also used when MSG_ZEROCOPY turns out unsupported
+        """
+        if self.file is None:
+            if hasattr(os, "memfd_create"):
+                fd = os.memfd_create("net-tester", 0)
+                self.file = os.fdopen(fd, "w+b")
+            else:
+                self.file = tempfile.TemporaryFile()
+            self.file.write(self.data)
+            self.file.flush()
+        self.mode = "sendfile"
+
+    def setup(self, sock: socket.socket) -> None:
+        """Per-socket options for the chosen mode"""
+        if self.mode == "msg":
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_ZEROCOPY, 1)
+            except OSError as e:
+                self.log.log_error(f"MSG_ZEROCOPY unsupported ({e}), using sendfile")
+                self._use_sendfile()
+
+    def send(self, sock: socket.socket) -> int:
+        """Send up to TCP_SEND_BURST chunks until the socket buffer is full"""
+        total = 0
+        for _ in range(TCP_SEND_BURST):
+            try:
+                if self.mode == "sendfile":
+                    sent = os.sendfile(sock.fileno(), self.file.fileno(), 0, self.length)
+                elif self.mode == "msg":
+                    sent = sock.send(self.data, MSG_ZEROCOPY)
+                else:
+                    sent = sock.send(self.data)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:     # ENOBUFS: optmem full of completions
+                    raise
+                sent = 0
+            total += sent
+            if sent < self.length:
+                break
+        if self.mode == "msg":
+            self.sends += 1
+            if self.sends % 64 == 0:
+                self.reap(sock)
+        return total
+
+    @staticmethod
+    def reap(sock: socket.socket) -> None:
+        """Drain MSG_ZEROCOPY completion notifications from the error queue"""
+        while True:
+            try:
+                sock.recvmsg(0, 256, socket.MSG_ERRQUEUE | socket.MSG_DONTWAIT)
+            except (BlockingIOError, OSError):
+                return
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+
+
+class TcpSendStats:
+    """
+    One sending socket's TCP_INFO bookkeeping
+    - sample() turns the cumulative counters into the interval's goodput
+      (bytes acked), RTT, RTT variance, cwnd and retransmits
+    """
+
+    __slots__ = ('last_acked', 'last_retrans')
+
+    def __init__(self, sock: socket.socket):
+        info = tcp_info(sock)
+        self.last_acked = info[4] if info else None
+        self.last_retrans = info[3] if info else 0
+
+    def sample(self, sock: socket.socket, sent: int) -> tuple:
+        """Return (bytes acked this interval, log_stat metrics)
+        - 'sent' stands in for the acked bytes when the kernel doesn't report them
+        """
+        info = tcp_info(sock)
+        if info is None:
+            return sent, {}
+        rtt, rttvar, cwnd, retrans, total_acked = info
+        acked = sent
+        if total_acked is not None and self.last_acked is not None:
+            acked = total_acked - self.last_acked
+        self.last_acked = total_acked
+        metrics = dict(rtt=rtt / 1000, rttvar=rttvar / 1000, cwnd=cwnd,
+                       retransmits=retrans - self.last_retrans, bytes_acked=acked)
+        self.last_retrans = retrans
+        return acked, metrics
+
+
+def _tcp_reverse_sender(log: Logger, sock: socket.socket, length: int,
+                        interval: int, results: Optional[list] = None) -> None:
+    """Server side of TCP -R / --bidir, run in its own thread
+    - Sends on 'sock', a dup of the connection the server loop reads from,
+      until the client closes it; the fd may be non-blocking (epoll, asyncio)
+    - Logs goodput / send rate / TCP_INFO every interval, labelled "reverse",
+      and appends the rows to 'results' for a --control session
+    """
+    addr = sock.getpeername()[:2]
+    transmitter = TcpTransmitter(log, length)
+    stats = TcpSendStats(sock)
+    # not select(): the epoll / asyncio servers hand us fds past FD_SETSIZE
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_WRITE)
+    sent = 0
+    last = time.time()
+    log.log_info(f"Sending reverse stream to {addr}")
+    try:
+        while True:
+            nbytes = transmitter.send(sock)
+            sent += nbytes
+            if not nbytes:      # socket buffer full
+                selector.select(interval)
+            now = time.time()
+            if now - last >= interval:
+                acked, metrics = stats.sample(sock, sent)
+                bandwidth = (acked / (now - last)) * 8 / 1e6
+                send_rate = (sent / (now - last)) * 8 / 1e6
+                log.log_stat(timestamp=now, ip=addr[0], port=addr[1],
+                             bandwidth=bandwidth, send_rate=send_rate,
+                             label="reverse", **metrics)
+                if results is not None:
+                    results.append((now, bandwidth, send_rate) + tuple(
+                        metrics.get(f) for f in RESULT_FIELDS["tcp reverse"][3:]))
+                sent = 0
+                last = now
+    except OSError:
+        pass    # the client closed the connection, the test is over
+    finally:
+        selector.close()
+        sock.close()
+        transmitter.close()
+    log.log_info(f"Reverse stream to {addr} finished")
+
+
+HELLO_CONTROL = -1      # tcp_hello(): the connection now belongs to the control channel
+
+
+def tcp_hello(log: Logger, sock, data, interval: int,
+              control: Optional['ControlChannel'] = None) -> int:
+    """Check the first bytes of a new connection for the -R / --bidir hello
+    - Starts _tcp_reverse_sender on a dup of 'sock' if the client asks for it
+    - Returns the hello's length, to leave out of the byte count (0 if none)
+    - A control connection (--control) is handed to 'control' on a dup of
+      'sock' and HELLO_CONTROL returned: the caller drops its end of it
+    """
+    if control is not None and data[:len(CTRL_MAGIC)] == CTRL_MAGIC:
+        control.serve(socket.socket(fileno=os.dup(sock.fileno())), bytes(data))
+        return HELLO_CONTROL
+    if len(data) < _TCP_HELLO.size or data[:len(TCP_MAGIC)] != TCP_MAGIC:
+        return 0
+    _, direction, length = _TCP_HELLO.unpack_from(data)
+    if direction in (DIRECTIONS["reverse"], DIRECTIONS["bidir"]):
+        dup = socket.socket(fileno=os.dup(sock.fileno()))
+        results = control.reverse(dup.getpeername()[:2]) if control is not None else None
+        threading.Thread(target=_tcp_reverse_sender, name="reverse", daemon=True,
+                         args=(log, dup, length or 8192, interval, results)).start()
+    return _TCP_HELLO.size
+
+
+class TcpClientStats:
+    """Per-connection byte counter of the TCP servers, reported every interval"""
+
+    __slots__ = ('addr', 'total_bytes', 'last_time', 'fresh', 'results')
+
+    def __init__(self, addr: tuple, now: float):
+        self.addr = addr
+        self.total_bytes = 0
+        self.last_time = now
+        self.fresh = True       # no data yet, the first read may hold a hello
+        self.results = None     # rows for the client's --control session
+
+    def report(self, log: Logger, now: float) -> None:
+        """Log the bandwidth received since the last report"""
+        elapsed = now - self.last_time
+        if elapsed <= 0 or self.total_bytes == 0:
+            return
+        bandwidth = (self.total_bytes / elapsed) * 8 / 1e6
+        log.log_stat(
+            timestamp=now,
+            ip=self.addr[0],
+            port=self.addr[1],
+            bandwidth=bandwidth,
+            bytes_received=self.total_bytes
+        )
+        if self.results is not None:
+            self.results.append((now, bandwidth))
+        self.total_bytes = 0
+        self.last_time = now
+
+
 def tester_tcp_client(log: Logger, server_ip: str, server_port: int,
-                      duration: int, interval: int) -> None:
+                      duration: int, interval: int, parallel: int = 1,
+                      zerocopy: Optional[str] = None, window: Optional[int] = None,
+                      length: int = 8192, direction: str = "forward",
+                      control: bool = False) -> None:
     """TCP client (Task 2)
     TODO:
       - Connect and send for 'duration' seconds (chunks of 'window')
       - Every 'interval' seconds, compute and log bandwidth
+    With parallel > 1 (-P), opens that many streams and drives them from one
+    non-blocking selector loop, logging each stream plus their SUM.
+    Every interval each stream's TCP_INFO is sampled: bandwidth is the bytes
+    the receiver acked (goodput), send_rate the bytes handed to the socket,
+    plus RTT, RTT variance, cwnd and retransmits.
+    Chunks of 'length' bytes go out through TcpTransmitter; 'zerocopy' picks
+    sendfile or MSG_ZEROCOPY and 'window' sets SO_SNDBUF.
+    With direction "reverse" (-R) the server sends and we receive, with
+    "bidir" both sides send at once; a hello at the start of each stream
+    tells the server, and received bandwidth is logged as "reverse".
+    With 'control' the test is first negotiated with the server (control_open)
+    and the server's own interval reports are fetched and logged at the end.
     """
-    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client_socket.connect((server_ip, server_port))  # Establishing connection
+    transmitter = TcpTransmitter(log, length, zerocopy)
+    streams = []
+    for _ in range(parallel):
+        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if window:
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, window)
+        if control:
+            client_socket.bind(('', 0))     # so the ports can be announced before connecting
+        streams.append(client_socket)
+
+    ctrl = None
+    if control:
+        try:
+            ctrl = control_open(log, server_ip, server_port, {
+                "proto": "tcp", "duration": duration, "length": length,
+                "interval": interval, "direction": direction,
+                "ports": [s.getsockname()[1] for s in streams]})
+        except (OSError, ValueError) as e:
+            log.log_error(f"Control channel: {e}")
+            for client_socket in streams:
+                client_socket.close()
+            transmitter.close()
+            return None
+
+    for client_socket in streams:
+        client_socket.connect((server_ip, server_port))  # Establishing connection
+        if direction != "forward":
+            client_socket.sendall(_TCP_HELLO.pack(TCP_MAGIC, DIRECTIONS[direction], length))
+        client_socket.setblocking(False)
+        transmitter.setup(client_socket)
+
+    sending = direction != "reverse"
+    receiving = direction != "forward"
+    events = ((selectors.EVENT_WRITE if sending else 0)
+              | (selectors.EVENT_READ if receiving else 0))
+    selector = selectors.DefaultSelector()
+    for i, client_socket in enumerate(streams):
+        selector.register(client_socket, events, i)
+    buffer = memoryview(bytearray(TCP_RECV_BUFFER)) if receiving else None
 
     start_time = time.time()
-    data = b"X" * 8192  # creating message
-    totalBytesSent = 0
+    bytesSent = [0] * parallel     # bytes sent per stream in this interval
+    bytesRecv = [0] * parallel     # bytes received per stream (-R / --bidir)
     lastTime = start_time
+    tcpStats = [TcpSendStats(s) for s in streams]
 
     log.log_info(f"Starting TCP client to {server_ip}:{server_port} "
-                 f"for {duration}s")
+                 f"for {duration}s ({parallel} stream{'s' if parallel > 1 else ''}, "
+                 f"{length} byte chunks, zerocopy={zerocopy}"
+                 + (f", {direction})" if direction != "forward" else ")"))
 
-    # While the duration of time isn't reached send all the packets and measure the bytes sent
-    while time.time() - start_time < duration:
-        try:
-            client_socket.sendall(data)
-            totalBytesSent += len(data)
-        except Exception as e:
-            log.log_error(f"Error: {e}")
+    def report(currentTime: float) -> None:
+        elapsed = currentTime - lastTime
+        if elapsed <= 0:
+            return
+        if sending:
+            acked_total = retrans_total = 0
+            for i, client_socket in enumerate(streams):
+                acked, metrics = tcpStats[i].sample(client_socket, bytesSent[i])
+                acked_total += acked
+                retrans_total += metrics.get('retransmits', 0)
+                log.log_stat(timestamp=currentTime, ip=server_ip, port=server_port,
+                             bandwidth=(acked / elapsed) * 8 / 1e6,
+                             send_rate=(bytesSent[i] / elapsed) * 8 / 1e6,
+                             label=f"stream {i + 1}" if parallel > 1 else None, **metrics)
+            if parallel > 1:
+                log.log_stat(timestamp=currentTime, ip=server_ip, port=server_port,
+                             bandwidth=(acked_total / elapsed) * 8 / 1e6,
+                             send_rate=(sum(bytesSent) / elapsed) * 8 / 1e6,
+                             retransmits=retrans_total, bytes_acked=acked_total,
+                             label="SUM")
+        if receiving:
+            if parallel > 1:
+                for i in range(parallel):
+                    log.log_stat(timestamp=currentTime, ip=server_ip, port=server_port,
+                                 bandwidth=(bytesRecv[i] / elapsed) * 8 / 1e6,
+                                 label=f"stream {i + 1} reverse")
+            log.log_stat(timestamp=currentTime, ip=server_ip, port=server_port,
+                         bandwidth=(sum(bytesRecv) / elapsed) * 8 / 1e6,
+                         label="SUM reverse" if parallel > 1 else "reverse")
+
+    # While the duration of time isn't reached send on every writable stream and measure the bytes sent
+    phases = log.phases
+    currentTime = start_time
+    while currentTime - start_time < duration and selector.get_map():
+        timeout = min(lastTime + interval, start_time + duration) - currentTime
+        if phases is not None:
+            t0 = time.perf_counter_ns()
+        ready = selector.select(timeout=max(0.0, timeout))
+        if phases is not None:
+            t0 = phases.add(PH_SLEEP, t0)   # blocked until a stream was ready
+        for key, mask in ready:
+            try:
+                if mask & selectors.EVENT_READ:
+                    nbytes = key.fileobj.recv_into(buffer)
+                    if not nbytes:
+                        raise ConnectionResetError("server closed the connection")
+                    bytesRecv[key.data] += nbytes
+                if mask & selectors.EVENT_WRITE:
+                    bytesSent[key.data] += transmitter.send(key.fileobj)
+            except BlockingIOError:
+                pass
+            except Exception as e:
+                log.log_error(f"Error: {e}")
+                selector.unregister(key.fileobj)    # drop the broken stream
+        if phases is not None:
+            phases.add(PH_SEND, t0)
+            phases.tick(log)
 
         currentTime = time.time()
         if currentTime - lastTime >= interval:
             # Make it so if interval is reached then do this.
-            elapsed = currentTime - lastTime
-            bandwidth = (totalBytesSent / elapsed) * 8 / 1e6
-            log.log_stat(
-                timestamp=currentTime,
-                ip=server_ip,  # when interval is reached, log bandwith.
-                port=server_port,
-                bandwidth=bandwidth
-            )
-            totalBytesSent = 0  # resetting for next packet
+            report(currentTime)     # when interval is reached, log bandwith.
+            bytesSent = [0] * parallel  # resetting for next interval
+            bytesRecv = [0] * parallel
             lastTime = currentTime
 
-    client_socket.close()
+    selector.close()
+    for client_socket in streams:
+        client_socket.close()
+    transmitter.close()
+    if ctrl is not None:
+        control_results(log, ctrl, server_ip, server_port, start_time)
     # Skeleton only; safe no-op if not implemented.
     return None
 
 
-def tester_tcp_server(log: Logger, port: int) -> None:
+def tester_tcp_server(log: Logger, port: int, interval: int = 1) -> None:
     """TCP server (Task 2)
     TODO:
       - Listen on 'port'; accept multiple clients
       - Receive/discard bytes; optionally log per-client bandwidth
+    A client's -R / --bidir hello starts a reverse sender (see tcp_hello),
+    a --control connection is served by a ControlChannel.
     """
+    control = ControlChannel(log, "tcp", interval)
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     # establishing connection
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -223,15 +1429,22 @@ def tester_tcp_server(log: Logger, port: int) -> None:
     # binding socket to any port that is available
     server_socket.bind(("0.0.0.0", port))
     rfds = [server_socket]  # list to read file descriptors
+    clients = {}            # socket -> TcpClientStats
     server_socket.listen()
 
     log.log_info(f"Server listening on port {port}")
 
     log.log_info(f"Starting TCP server on port {port}")
+    phases = log.phases
 
+    next_report = time.time() + interval
     while True:
         # checking sockets for data and reading
-        rlist, _, _ = select.select(rfds, [], [])
+        if phases is not None:
+            t0 = time.perf_counter_ns()
+        rlist, _, _ = select.select(rfds, [], [], max(0.0, next_report - time.time()))
+        if phases is not None:
+            phases.add(PH_SLEEP, t0)    # waiting for a ready socket
 
         if server_socket in rlist:
             # accepts incoming client connection and returns a new socket and its address
@@ -239,6 +1452,8 @@ def tester_tcp_server(log: Logger, port: int) -> None:
             log.log_info(f"Client connected from {client_address}")
 
             rfds.append(client_socket)
+            clients[client_socket] = TcpClientStats(client_address, time.time())
+            control.attach(client_address, clients[client_socket])
 
             rlist.remove(server_socket)
 
@@ -247,45 +1462,1208 @@ def tester_tcp_server(log: Logger, port: int) -> None:
                 continue
 
             # recieve data up to 4096 bytes (4kb for large buffer)
-            data = client_socket.recv(4096)
+            if phases is not None:
+                t0 = time.perf_counter_ns()
+            try:
+                data = client_socket.recv(4096)
+            except ConnectionResetError:    # a -R client closing with data unread
+                data = b""
+            if phases is not None:
+                phases.add(PH_RECV, t0)
 
+            stats = clients[client_socket]
             if len(data) == 0:  # if there is no more data to be recieved, close connection
+                stats.report(log, time.time())
+                control.finished(stats.addr)
                 client_socket.close()
                 rfds.remove(client_socket)
-                break
+                del clients[client_socket]
+                continue    # keep serving the other ready sockets
+
+            nbytes = len(data)
+            if stats.fresh:  # first data: maybe a -R / --bidir hello
+                stats.fresh = False
+                hello = tcp_hello(log, client_socket, data, interval, control)
+                if hello == HELLO_CONTROL:  # control connection, no longer ours
+                    client_socket.close()
+                    rfds.remove(client_socket)
+                    del clients[client_socket]
+                    continue
+                nbytes -= hello
+            stats.total_bytes += nbytes
+
+        now = time.time()
+        if now >= next_report:   # per-client interval reports
+            for stats in clients.values():
+                stats.report(log, now)
+            next_report = max(next_report + interval, now)
+        if phases is not None:
+            phases.tick(log)
 
     # Skeleton only; safe no-op if not implemented.
     return None
 
+
+def tester_tcp_server_epoll(log: Logger, port: int, interval: int) -> None:
+    """TCP server on epoll (--engine epoll)
+    - selectors.DefaultSelector is epoll on Linux: O(ready) per wait and no
+      FD_SETSIZE limit, unlike select() over a growing list
+    - Every read is a recv_into() one preallocated TCP_RECV_BUFFER bytearray,
+      so no bytes object is allocated per read
+    - Per-client bandwidth is logged every 'interval' seconds
+    """
+    control = ControlChannel(log, "tcp", interval)
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind(("0.0.0.0", port))
+    server_socket.listen(4096)
+    server_socket.setblocking(False)
+
+    selector = selectors.DefaultSelector()
+    selector.register(server_socket, selectors.EVENT_READ, None)
+    buffer = memoryview(bytearray(TCP_RECV_BUFFER))
+    clients = {}    # socket -> TcpClientStats
+
+    log.log_info(f"Starting TCP server on port {port} "
+                 f"(engine={type(selector).__name__})")
+    phases = log.phases
+
+    next_report = time.time() + interval
+    try:
+        while True:
+            if phases is not None:
+                t0 = time.perf_counter_ns()
+            events = selector.select(timeout=max(0.0, next_report - time.time()))
+            if phases is not None:
+                phases.add(PH_SLEEP, t0)    # waiting for ready sockets
+
+            for key, _ in events:
+                if key.data is None:
+                    # accept every pending connection on the listening socket
+                    while True:
+                        try:
+                            client_socket, client_address = server_socket.accept()
+                        except BlockingIOError:
+                            break
+                        client_socket.setblocking(False)
+                        stats = TcpClientStats(client_address, time.time())
+                        control.attach(client_address, stats)
+                        clients[client_socket] = stats
+                        selector.register(client_socket, selectors.EVENT_READ, stats)
+                        log.log_info(f"Client connected from {client_address}")
+                    continue
+
+                client_socket = key.fileobj
+                if phases is not None:
+                    t0 = time.perf_counter_ns()
+                try:
+                    nbytes = client_socket.recv_into(buffer)
+                except BlockingIOError:
+                    continue
+                except ConnectionResetError:    # a -R client closing with data unread
+                    nbytes = 0
+                except OSError as e:
+                    log.log_error(f"Error: {e}")
+                    nbytes = 0
+                if phases is not None:
+                    phases.add(PH_RECV, t0)
+
+                if nbytes:
+                    hello = 0
+                    if key.data.fresh:      # first data: maybe a -R / --bidir hello
+                        key.data.fresh = False
+                        hello = tcp_hello(log, client_socket, buffer[:nbytes], interval,
+                                          control)
+                        if hello == HELLO_CONTROL:  # control connection, no longer ours
+                            selector.unregister(client_socket)
+                            del clients[client_socket]
+                            client_socket.close()
+                            continue
+                    key.data.total_bytes += nbytes - hello    # the hello is not payload
+                else:   # peer closed the connection, log its last partial interval
+                    key.data.report(log, time.time())
+                    control.finished(key.data.addr)
+                    log.log_info(f"Client {key.data.addr} disconnected")
+                    selector.unregister(client_socket)
+                    del clients[client_socket]
+                    client_socket.close()
+
+            now = time.time()
+            if now >= next_report:   # per-client interval reports
+                for stats in clients.values():
+                    stats.report(log, now)
+                next_report += interval
+                if next_report < now:
+                    next_report = now + interval
+            if phases is not None:
+                phases.tick(log)
+    except KeyboardInterrupt:
+        log.log_info("Server interrupted by user")
+    finally:
+        for client_socket in clients:
+            client_socket.close()
+        selector.close()
+        server_socket.close()
+
+    return None
+
+# ---------------------- UDP sender / receiver engines ----------------------
+
+UDP_PACKET_SIZE = 1472  # 1500 byte MTU - 20 byte IP header - 8 byte UDP header
+_ID = struct.Struct('!I')  # 4B big-endian datagram ID at the start of every packet
+# ... followed by the client's send time (epoch seconds) and its session ID
+_HEADER = struct.Struct('!IdI')
+_ACK = struct.Struct('!Iddd')   # ID, echoed send time, server receive time, server send time
+# selective ACK (--sack): marker ID, highest ID, bitmap of the 64 IDs ending at
+# the highest (bit i = ID highest - 63 + i), then the _ACK timestamps of the highest
+_SACK = struct.Struct('!IIQddd')
+SACK_ID = 0xFFFFFFFF
+SACK_BITS = 64
+SACK_MS = 10.0      # default --sack-ms
+# -R / --bidir hello: HELLO_ID, direction, rate (Kbps), datagram size, duration (s), batch
+HELLO_ID = 0xFFFFFFFE
+_UDP_HELLO = struct.Struct('!IB3xIIII')
+HELLO_RETRY = 0.2   # seconds between hellos until the reverse stream starts
+UDP_IDLE_TIMEOUT = 10.0     # default --idle-timeout: seconds before a silent session is dropped
+SWEEP_INTERVAL = 1.0        # seconds between idle session sweeps
+REORDER_DEADLINE = 0.5      # seconds a gap may still be filled before it counts as lost
+
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_IoVec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+def _load_libc():
+    """Return libc if it exposes sendmmsg/recvmmsg (Linux only), otherwise None"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "sendmmsg") or not hasattr(libc, "recvmmsg"):
+        return None
+    libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr),
+                              ctypes.c_uint, ctypes.c_int]
+    libc.sendmmsg.restype = ctypes.c_int
+    libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr),
+                              ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    libc.recvmmsg.restype = ctypes.c_int
+    return libc
+
+
+_libc = _load_libc()
+
+
+def _sockaddr_in(ip: str, port: int) -> ctypes.Array:
+    """Build a raw struct sockaddr_in for the ctypes msghdr"""
+    raw = struct.pack('=H', socket.AF_INET) + struct.pack('!H', port) + \
+        socket.inet_aton(ip) + bytes(8)
+    return ctypes.create_string_buffer(raw, len(raw))
+
+
+class UdpSender:
+    """
+    Zero-copy batched datagram sender
+    - One bytearray holds 'batch' packets back to back, allocated once
+    - The 16B header (ID + send time + session ID) of each slot is patched in
+      place with struct.pack_into; one timestamp is taken per batch
+    - A batch goes out in a single sendmmsg() syscall when libc has it,
+      otherwise one sendto() per datagram straight from the memoryview;
+      more than 'batch' datagrams (a Pacer backlog) go out batch by batch
+    """
+
+    def __init__(self, sock: socket.socket, server_ip: str, server_port: int,
+                 packet_size: int = UDP_PACKET_SIZE, batch: int = 1, session: int = 0):
+        self.sock = sock
+        self.addr = (socket.gethostbyname(server_ip), server_port)
+        self.session = session  # 0: the server keys our state by address
+        self.packet_size = packet_size
+        self.batch = max(1, batch)
+        self.buf = bytearray(b"X" * (packet_size * self.batch))
+        view = memoryview(self.buf)
+        self.slots = [view[i * packet_size:(i + 1) * packet_size]
+                      for i in range(self.batch)]
+
+        # the mmsghdr array only points into self.buf, so it is built once too
+        self.msgs = None
+        if _libc is not None and self.batch > 1:
+            self._name = _sockaddr_in(*self.addr)
+            base = ctypes.addressof(ctypes.c_char.from_buffer(self.buf))
+            self._iovs = (_IoVec * self.batch)()
+            self.msgs = (_MMsgHdr * self.batch)()
+            for i in range(self.batch):
+                self._iovs[i].iov_base = base + i * packet_size
+                self._iovs[i].iov_len = packet_size
+                hdr = self.msgs[i].msg_hdr
+                hdr.msg_name = ctypes.addressof(self._name)
+                hdr.msg_namelen = len(self._name)
+                hdr.msg_iov = ctypes.pointer(self._iovs[i])
+                hdr.msg_iovlen = 1
+        self.phases = None  # PhaseCounters when --profile is on
+
+    def send(self, first_id: int, count: int) -> int:
+        """Send 'count' datagrams with IDs first_id.. and return how many went out"""
+        sent = 0
+        while sent < count:
+            chunk = min(count - sent, self.batch)
+            done = self._send(first_id + sent, chunk)
+            sent += done
+            if done < chunk:    # the socket took less, leave the rest to the pacer
+                break
+        return sent
+
+    def _send(self, first_id: int, count: int) -> int:
+        """Send one batch of up to self.batch datagrams"""
+        phases = self.phases
+        if phases is not None:
+            t0 = time.perf_counter_ns()
+        now = time.time()
+        for i in range(count):
+            _HEADER.pack_into(self.buf, i * self.packet_size, first_id + i, now, self.session)
+        if phases is not None:
+            t0 = phases.add(PH_PACK, t0)
+
+        if self.msgs is not None and count > 1:
+            sent = _libc.sendmmsg(self.sock.fileno(), self.msgs, count, 0)
+            if sent < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+        else:
+            for i in range(count):
+                self.sock.sendto(self.slots[i], self.addr)
+            sent = count
+        if phases is not None:
+            phases.add(PH_SEND, t0)
+        return sent
+
+    def send_one(self, packet_id: int) -> None:
+        """Send a single datagram (used for the ID 0 termination packet)"""
+        _HEADER.pack_into(self.buf, 0, packet_id, time.time(), self.session)
+        self.sock.sendto(self.slots[0], self.addr)
+
+
+MSG_WAITFORONE = 0x10000   # recvmmsg: block for the first datagram only
+_SOCKADDR_IN = struct.Struct('!2xH4s8x')  # family (native, skipped), port, IPv4
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)  # Linux; SCM_TIMESTAMPNS is the same value
+_CMSGHDR = struct.Struct('@Nii')    # cmsg_len, cmsg_level, cmsg_type (data follows, aligned)
+_TIMESPEC = struct.Struct('@ll')    # tv_sec, tv_nsec
+_TIMEVAL = struct.Struct('@ll')     # tv_sec, tv_usec (SO_RCVTIMEO)
+_TS_SPACE = socket.CMSG_SPACE(_TIMESPEC.size) if hasattr(socket, "CMSG_SPACE") else 0
+
+
+def enable_rx_timestamps(sock: socket.socket) -> bool:
+    """Ask for SO_TIMESTAMPNS receive times; False if the platform can't"""
+    if not _TS_SPACE:
+        return False
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    except OSError:
+        return False
+    return True
+
+
+def rx_timestamp(ancdata: list) -> float:
+    """Kernel receive time from recvmsg() ancillary data, 0.0 if there is none"""
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+            sec, nsec = _TIMESPEC.unpack_from(data)
+            return sec + nsec * 1e-9
+    return 0.0
+
+
+def set_rcvbuf(log: Logger, sock: socket.socket, size: Optional[int]) -> None:
+    """Set SO_RCVBUF (bytes) and report what the kernel actually granted"""
+    if not size:
+        return
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    except OSError as e:
+        log.log_error(f"Could not set SO_RCVBUF to {size}: {e}")
+        return
+    # Linux doubles the value for bookkeeping and caps it at net.core.rmem_max
+    granted = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    log.log_info(f"SO_RCVBUF requested {size} bytes, kernel granted {granted}")
+
+
+class UdpReceiver:
+    """
+    Batched datagram receiver
+    - A ring of 'batch' preallocated buffers, filled by one recvmmsg() call
+      when libc has it, otherwise one recvmsg_into() per call
+    - recv() returns how many slots were filled; slot i holds
+      self.slots[i][:self.lengths[i]] received from self.addrs[i]
+    - Parse headers with struct.unpack_from on the slot, nothing is copied
+    - With 'timestamps', SO_TIMESTAMPNS makes the kernel attach its receive
+      time to every datagram and self.times[i] holds it (epoch seconds, like
+      time.time()); it is 0.0 when a datagram came without one, and
+      self.timestamps is False if the socket option is not supported
+    """
+
+    def __init__(self, sock: socket.socket, packet_size: int = UDP_PACKET_SIZE,
+                 batch: int = 1, timestamps: bool = False):
+        self.sock = sock
+        self.packet_size = packet_size
+        self.batch = max(1, batch)
+        self.buf = bytearray(packet_size * self.batch)
+        view = memoryview(self.buf)
+        self.slots = [view[i * packet_size:(i + 1) * packet_size]
+                      for i in range(self.batch)]
+        self.lengths = [0] * self.batch
+        self.addrs = [None] * self.batch
+        self.times = [0.0] * self.batch
+        self._addr_cache = {}   # (port, raw ip) -> (ip, port), avoids inet_ntoa per packet
+
+        self.timestamps = timestamps and enable_rx_timestamps(sock)
+        self._ancbufsize = _TS_SPACE if self.timestamps else 0
+
+        self.msgs = None
+        if _libc is not None and self.batch > 1:
+            self.names = bytearray(16 * self.batch)   # one sockaddr_in per slot
+            self.control = bytearray(self._ancbufsize * self.batch)  # one cmsg per slot
+            base = ctypes.addressof(ctypes.c_char.from_buffer(self.buf))
+            names = ctypes.addressof(ctypes.c_char.from_buffer(self.names))
+            control = (ctypes.addressof(ctypes.c_char.from_buffer(self.control))
+                       if self.timestamps else None)
+            self._iovs = (_IoVec * self.batch)()
+            self.msgs = (_MMsgHdr * self.batch)()
+            for i in range(self.batch):
+                self._iovs[i].iov_base = base + i * packet_size
+                self._iovs[i].iov_len = packet_size
+                hdr = self.msgs[i].msg_hdr
+                hdr.msg_name = names + i * 16
+                hdr.msg_iov = ctypes.pointer(self._iovs[i])
+                hdr.msg_iovlen = 1
+                if control is not None:
+                    hdr.msg_control = control + i * self._ancbufsize
+        self.phases = None  # PhaseCounters when --profile is on
+
+    def recv(self) -> int:
+        """Block until at least one datagram arrives, then drain up to 'batch'"""
+        if self.phases is not None:
+            t0 = time.perf_counter_ns()
+            n = self._recv()
+            self.phases.add(PH_RECV, t0)
+            return n
+        return self._recv()
+
+    def _recv(self) -> int:
+        if self.msgs is None:
+            nbytes, ancdata, _, addr = self.sock.recvmsg_into([self.slots[0]],
+                                                              self._ancbufsize)
+            self.lengths[0] = nbytes
+            self.addrs[0] = addr
+            if self.timestamps:
+                self.times[0] = rx_timestamp(ancdata)
+            return 1
+
+        for i in range(self.batch):
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_namelen = 16   # value-result, reset every call
+            hdr.msg_controllen = self._ancbufsize
+        n = _libc.recvmmsg(self.sock.fileno(), self.msgs, self.batch,
+                           MSG_WAITFORONE, None)
+        if n < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise BlockingIOError(err, os.strerror(err))
+            if err == errno.EINTR:
+                raise InterruptedError(err, os.strerror(err))
+            raise OSError(err, os.strerror(err))
+
+        cache = self._addr_cache
+        for i in range(n):
+            self.lengths[i] = self.msgs[i].msg_len
+            key = _SOCKADDR_IN.unpack_from(self.names, i * 16)
+            addr = cache.get(key)
+            if addr is None:
+                addr = cache[key] = (socket.inet_ntoa(key[1]), key[0])
+            self.addrs[i] = addr
+
+        if self.timestamps:
+            control, space = self.control, self._ancbufsize
+            for i in range(n):
+                self.times[i] = 0.0
+                if self.msgs[i].msg_hdr.msg_controllen >= _CMSGHDR.size + _TIMESPEC.size:
+                    _, level, kind = _CMSGHDR.unpack_from(control, i * space)
+                    if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                        sec, nsec = _TIMESPEC.unpack_from(control, i * space + _CMSGHDR.size)
+                        self.times[i] = sec + nsec * 1e-9
+        return n
+
+# ---------------------- UDP rate pacer ----------------------
+
+class Pacer:
+    """
+    Deadline based rate pacer (a token bucket of depth 'max_burst', its own
+    and not the syscall --batch: a late wakeup is caught up with a burst)
+    - Packet k is due at start + k * period on the perf_counter_ns clock, so
+      the time spent sending never accumulates as rate drift
+    - wait() blocks until the next deadline and returns how many packets are
+      due; when the sender fell behind that is a small burst (<= max_burst)
+    - Sleeps with time.sleep() until SPIN_NS before the deadline and busy
+      waits the rest, which keeps the error well under 100us
+    """
+
+    SPIN_NS = 200_000   # busy wait the last 200us, time.sleep() overshoots by ~50-100us
+    BURST = 8           # default bucket depth, packets
+
+    def __init__(self, rate_pps: float, max_burst: int = BURST):
+        self.period_ns = max(1, int(1e9 / rate_pps))
+        self.max_burst = max(1, max_burst)
+        self.start_ns = time.perf_counter_ns()
+        self.credited = 0   # packets whose deadline has been handed out
+        self.phases = None  # PhaseCounters when --profile is on
+
+    def wait(self) -> int:
+        """Wait for the next deadline; return the number of packets to send now"""
+        due_ns = self.start_ns + self.credited * self.period_ns
+        now = time.perf_counter_ns()
+        if now < due_ns:
+            t0 = now
+            if due_ns - now > Pacer.SPIN_NS:
+                time.sleep((due_ns - now - Pacer.SPIN_NS) / 1e9)
+            while now < due_ns:
+                now = time.perf_counter_ns()
+            if self.phases is not None:
+                self.phases.record(PH_SLEEP, now - t0)
+                self.phases.record(PH_OVERSHOOT, now - due_ns)
+
+        due = (now - self.start_ns) // self.period_ns + 1 - self.credited
+        if due > self.max_burst:
+            # the bucket is full: forget the older backlog instead of
+            # bursting at line rate after a stall
+            self.credited += due - self.max_burst
+            due = self.max_burst
+        return due
+
+    def done(self, count: int) -> None:
+        """Credit 'count' packets that were actually sent"""
+        self.credited += count
+
+# ---------------------- UDP server statistics ----------------------
+
+class SeqTracker:
+    """
+    Sequence tracker over a sliding bitmap window of the latest 'window' IDs
+    - The bitmap is a bytearray ring indexed by ID % window, so memory is
+      fixed (window / 8 bytes) and every arrival is classified in O(1)
+    - An ID above the highest seen opens a gap, kept pending: an ID inside
+      the window whose bit is clear fills it (out of order, not lost), even
+      across interval boundaries
+    - A gap is settled, and its still missing IDs counted as lost, once it is
+      REORDER_DEADLINE old (settle(), at report time) or before its slots
+      leave the window; so loss is never reported and then taken back
+    - An ID inside the window whose bit is set is a duplicate
+    - An ID older than the window, or in a gap already settled as lost, is
+      late: counted, but not un-lost
+    - Interval counters (i_*) are cleared by new_interval()
+    """
+
+    __slots__ = ('mask', 'bits', 'highest', 'pending', 'settled', 'i_received',
+                 'i_lost', 'i_out_of_order', 'i_duplicates', 'i_late')
+
+    def __init__(self, window: int = 4096):
+        window = 1 << max(3, (window - 1).bit_length())   # round up to a power of two
+        self.mask = window - 1
+        self.bits = bytearray(window >> 3)
+        self.highest = 0          # IDs start at 1
+        self.pending = deque()    # gaps not settled yet: (first ID, last ID, deadline)
+        self.settled = 0          # IDs up to this one are settled
+        self.new_interval()
+
+    def new_interval(self) -> None:
+        self.i_received = 0       # new IDs received, in order or not
+        self.i_lost = 0           # missing IDs settled as lost
+        self.i_out_of_order = 0
+        self.i_duplicates = 0
+        self.i_late = 0
+
+    def add(self, packet_id: int, now: float) -> bool:
+        """Record an arrival at 'now'; return False for duplicates and late packets"""
+        bits = self.bits
+        highest = self.highest
+        if packet_id > highest:
+            pending = self.pending
+            # the slots up to packet_id - window are about to be reused
+            while pending and pending[0][0] + self.mask < packet_id:
+                self._settle_first()
+            gap = packet_id - highest - 1
+            if gap:
+                first = highest + 1
+                if gap > self.mask:     # the oldest part of the gap never fits the window
+                    first = packet_id - self.mask
+                    self.i_lost += first - highest - 1
+                    self.settled = first - 1
+                    bits[:] = bytes(len(bits))
+                else:
+                    for pid in range(first, packet_id):     # recycle the slots
+                        bits[(pid & self.mask) >> 3] &= ~(1 << (pid & 7))
+                pending.append((first, packet_id - 1, now + REORDER_DEADLINE))
+            self.i_received += 1
+            self.highest = packet_id
+            bits[(packet_id & self.mask) >> 3] |= 1 << (packet_id & 7)
+            return True
+
+        if highest - packet_id > self.mask:
+            self.i_late += 1
+            return False
+
+        index = (packet_id & self.mask) >> 3
+        bit = 1 << (packet_id & 7)
+        if bits[index] & bit:
+            self.i_duplicates += 1
+            return False
+        if packet_id <= self.settled:   # already counted as lost
+            self.i_late += 1
+            return False
+        bits[index] |= bit
+        self.i_received += 1
+        self.i_out_of_order += 1
+        return True
+
+    def settle(self, now: float) -> None:
+        """Count the gaps older than REORDER_DEADLINE (math.inf: all of them)"""
+        pending = self.pending
+        while pending and pending[0][2] <= now:
+            self._settle_first()
+
+    def _settle_first(self) -> None:
+        first, last, _ = self.pending.popleft()
+        bits, mask = self.bits, self.mask
+        for pid in range(first, last + 1):
+            if not bits[(pid & mask) >> 3] & (1 << (pid & 7)):
+                self.i_lost += 1
+        self.settled = last
+
+    def bitmap(self) -> int:
+        """Received flags of the SACK_BITS IDs ending at the highest one
+        - Bit i stands for ID highest - SACK_BITS + 1 + i; read straight out of
+          the ring as a little-endian integer, in two pieces if it wraps
+        """
+        size = self.mask + 1
+        start = (self.highest - SACK_BITS + 1) & self.mask
+        raw = int.from_bytes(self.bits[start >> 3:(start + SACK_BITS + 7) // 8 + 1], 'little')
+        raw >>= start & 7
+        if start + SACK_BITS > size:
+            head = size - start     # bits up to the end of the ring
+            raw &= (1 << head) - 1
+            raw |= int.from_bytes(self.bits[:SACK_BITS // 8], 'little') << head
+        return raw & ((1 << SACK_BITS) - 1)
+
+
+class ClientStats:
+    """
+    Streaming per-client accumulator for the UDP server
+    - Per packet work is O(1) and memory is a handful of slots plus a fixed
+      SeqTracker bitmap per client, whatever the rate or interval length
+    - Loss, reordering and duplicates come from the SeqTracker
+    - Jitter is the RFC 3550 estimator J += (|D| - J) / 16, where D is the
+      difference in transit time (arrival - send time in the header) of two
+      consecutive packets, so it doesn't depend on any configured rate;
+      datagrams without a send time fall back to the send time their ID
+      implies at the expected sending interval. Arrivals are kernel receive
+      timestamps when the engine has them
+    """
+
+    __slots__ = ('seq', 'count', 'total_bytes', 'last_transit',
+                 'jitter', 'start_time', 'last_time',
+                 'sack_base', 'sack_count', 'sack_time', 'high_sent', 'high_arrival',
+                 'expected_interval', 'interval', 'results', 'addr', 'last_seen', 'lag')
+
+    def __init__(self, now: float, expected_interval: float = 0.0, interval: float = 1):
+        self.seq = SeqTracker()
+        self.count = 0            # packets received this interval
+        self.total_bytes = 0      # bytes received this interval
+        self.last_transit = None  # None until the first packet arrives
+        self.jitter = 0.0         # running RFC 3550 jitter, seconds
+        self.start_time = now
+        self.last_time = now      # start of the current interval
+        # selective ACK state (--sack)
+        self.sack_base = 0        # highest ID covered by the last SACK
+        self.sack_count = 0       # new packets since the last SACK
+        self.sack_time = now
+        self.high_sent = 0.0      # client send / our receive time of the highest ID
+        self.high_arrival = 0.0
+        # test parameters, the client's own when it negotiated them (--control)
+        self.expected_interval = expected_interval
+        self.interval = interval
+        self.results = None       # rows for the client's --control session
+        self.addr = None          # latest source address (it may change, see UdpSessions)
+        self.last_seen = now      # for the idle timeout
+        self.lag = 0.0            # summed kernel receive -> processing delay this interval
+
+    def update(self, packet_id: int, nbytes: int, arrival: float,
+               expected_interval: float, sent: float = 0.0) -> bool:
+        """Account for one datagram received at 'arrival' (epoch seconds)
+        - sent: the sender's timestamp from the header, 0.0 if it has none
+        - Returns False for duplicates and late packets
+        """
+        self.count += 1
+        self.total_bytes += nbytes
+        if not self.seq.add(packet_id, arrival):
+            return False    # duplicates and late packets don't feed the jitter estimate
+
+        # clock offset between the hosts cancels out in the difference
+        transit = arrival - (sent or packet_id * expected_interval)
+        if self.last_transit is not None:
+            self.jitter += (abs(transit - self.last_transit) - self.jitter) / 16
+        self.last_transit = transit
+        return True
+
+    def report(self, log: Logger, addr: tuple, now: float,
+               label: Optional[str] = None, final: bool = False) -> None:
+        """Log bandwidth / loss / jitter for the interval and start a new one
+        - Loss is what SeqTracker settled by now; 'final' settles every gap
+          (the flow ended, nothing more will fill them)
+        """
+        elapsed = now - self.last_time
+        if elapsed <= 0:
+            elapsed = 1e-6
+
+        bandwidth = (self.total_bytes / elapsed) * 8 / 1e6
+        seq = self.seq
+        seq.settle(math.inf if final else now)
+        lost = seq.i_lost
+        expected = lost + seq.i_received
+        loss = (lost / expected) * 100 if expected else 0.0
+
+        log.log_stat(
+            timestamp=now,
+            ip=addr[0],
+            port=addr[1],
+            bandwidth=bandwidth,
+            loss=loss,
+            jitter=self.jitter * 1000.0,
+            lost=lost,
+            out_of_order=seq.i_out_of_order,
+            duplicates=seq.i_duplicates + seq.i_late,
+            label=label,
+            bytes_received=self.total_bytes,
+            packets_received=self.count,
+            # only known when the engine has kernel receive timestamps
+            loop_latency=self.lag / self.count * 1000.0 if self.lag and self.count else None
+        )
+        if self.results is not None:
+            self.results.append((now, bandwidth, loss, self.jitter * 1000.0, lost,
+                                 seq.i_out_of_order, seq.i_duplicates + seq.i_late))
+
+        seq.new_interval()
+        self.count = 0          # resetting, jitter keeps running across intervals
+        self.total_bytes = 0
+        self.lag = 0.0
+        self.last_time = now
+
+
+class UdpSessions:
+    """
+    Per-client state of a UDP server, shared by every receive engine
+    - datagram() accounts for one received datagram and returns the ACK to
+      send back (or None), so each engine can send it its own way
+    - Clients are tracked by the session ID in their header, so a NAT
+      rebinding or a client sending from several sockets stays one test;
+      datagrams without one (session 0) are tracked by (ip, port). Each is
+      reported every 'interval' seconds
+    - Sessions silent for 'idle_timeout' seconds (their ID 0 was lost, or
+      never sent) are reported one last time and dropped; a heap ordered by
+      deadline is swept every SWEEP_INTERVAL, from datagram() or, when no
+      datagram comes, by the engine's timer calling sweep(), so memory stays
+      bounded on a long-running server
+    - With 'sack' (and ack), one selective ACK covers up to SACK_BITS packets:
+      it goes out after 'sack' new packets or 'sack_ms' since the previous one
+      (checked as datagrams arrive), and early if the next ID would slide the
+      bitmap past packets no SACK has covered yet
+    - A HELLO_ID datagram (-R / --bidir) starts a reverse stream to its sender
+      on 'sock', in a thread; the client's ID 0 stops it
+    - Clients that negotiated their test over 'control' use their own rate,
+      packet size and interval, and their reports go back to them
+    """
+
+    def __init__(self, log: Logger, rate: int, interval: int, ack: bool,
+                 sack: int = 0, sack_ms: float = SACK_MS,
+                 sock: Optional[socket.socket] = None,
+                 control: Optional[ControlChannel] = None,
+                 idle_timeout: float = UDP_IDLE_TIMEOUT):
+        self.log = log
+        self.sock = sock
+        self.control = control
+        self.idle_timeout = idle_timeout
+        self.expiry = []         # heap of (deadline, push count, key, ClientStats)
+        self.pushes = 0          # tie-breaker: keys are ints and tuples, stats don't compare
+        self.next_sweep = 0.0
+        self.senders = {}        # (ip, port) -> stop Event of its reverse stream
+        self.interval = interval
+        self.ack = ack
+        self.sack = sack if ack else 0
+        self.sack_interval = sack_ms / 1000
+        self.expected_interval = (UDP_PACKET_SIZE * 8) / (rate * 1000)
+        self.clients = {}        # session ID or (ip, port) -> ClientStats, to handle multiple clients
+
+    def datagram(self, data, nbytes: int, addr: tuple, now: float,
+                 arrival: float = 0.0) -> Optional[bytes]:
+        """Handle one datagram held in data[:nbytes] (bytes, bytearray or memoryview)
+        - arrival: kernel receive timestamp, 0.0 to fall back to 'now'
+        """
+        if nbytes < 4:  # if the datagram is less than 4 bytes it cant contain a valid packet id
+            return None
+
+        packet_id = _ID.unpack_from(data)[0]  # first 4 bytes, read in place
+        if packet_id == HELLO_ID:
+            self._hello(data, nbytes, addr)
+            return None
+        lag = now - arrival if arrival else 0.0
+        arrival = arrival or now
+        if now >= self.next_sweep:
+            self.sweep(now)
+        # the client's send time, echoed next to ours for one-way delays
+        if nbytes >= _HEADER.size:
+            _, sent, session = _HEADER.unpack_from(data)
+        else:
+            sent, session = 0.0, 0
+        key = session or addr
+        reply = None
+
+        if packet_id == 0:  # termination packet, so log data if there is any
+            self.log.log_info(f"Received termination datagram (ID 0) from {addr}: "
+                              f"finishing UDP session")
+            stats = self.clients.pop(key, None)  # Clean up client data
+            stop = self.senders.get(addr)
+            if stop is not None:    # the client is done, so is its reverse stream
+                stop.set()
+            if stats is not None and (stats.count > 0 or stats.seq.pending):
+                stats.report(self.log, addr, now, final=True)
+            if self.control is not None:
+                self.control.finished(key)
+            if self.sack:   # settle what the last SACK did not cover
+                return self._sack(stats) if stats is not None and stats.sack_count else None
+        else:
+            stats = self.clients.get(key)
+            if stats is None:  # create new client if it does not exist yet
+                stats = self.clients[key] = ClientStats(now, self.expected_interval,
+                                                        self.interval)
+                self.pushes += 1
+                heapq.heappush(self.expiry, (now + self.idle_timeout, self.pushes, key, stats))
+                negotiated = self.control.attach(key, stats) if self.control else None
+                if negotiated is not None:
+                    stats.expected_interval = negotiated.expected_interval
+                    stats.interval = negotiated.interval
+            stats.addr = addr
+            stats.last_seen = now
+            stats.lag += lag
+            if self.sack and stats.sack_count and packet_id > stats.sack_base + SACK_BITS:
+                reply = self._sack(stats)   # the bitmap is about to slide past unacked IDs
+            new = stats.update(packet_id, nbytes, arrival, stats.expected_interval, sent)
+
+            if self.sack and new:
+                stats.sack_count += 1
+                if packet_id == stats.seq.highest:
+                    stats.high_sent = sent
+                    stats.high_arrival = arrival
+                if reply is None and (stats.sack_count >= self.sack
+                                      or now - stats.sack_time >= self.sack_interval):
+                    reply = self._sack(stats)
+
+            if now - stats.last_time >= stats.interval:  # when interval is reached report the log
+                stats.report(self.log, addr, now)
+
+        if self.sack:
+            return reply
+        if self.ack:
+            return _ACK.pack(packet_id, sent, arrival, time.time())
+        return None
+
+    def sweep(self, now: float) -> None:
+        """Drop the sessions that have been silent for idle_timeout
+        - Each session has one heap entry; when it comes due but the session
+          was active since, it is pushed back with its new deadline
+        """
+        self.next_sweep = now + SWEEP_INTERVAL
+        heap = self.expiry
+        while heap and heap[0][0] <= now:
+            _, _, key, stats = heapq.heappop(heap)
+            if self.clients.get(key) is not stats:
+                continue    # it ended with an ID 0
+            deadline = stats.last_seen + self.idle_timeout
+            if deadline > now:
+                self.pushes += 1
+                heapq.heappush(heap, (deadline, self.pushes, key, stats))
+                continue
+            del self.clients[key]
+            if stats.count > 0 or stats.seq.pending:
+                stats.report(self.log, stats.addr, now, final=True)
+            if self.control is not None:
+                self.control.finished(key)
+            self.log.log_info(f"UDP session from {stats.addr} silent for "
+                              f"{self.idle_timeout:g}s: dropped")
+
+    def _hello(self, data, nbytes: int, addr: tuple) -> None:
+        """Start the reverse stream a -R / --bidir client asked for
+        - Hellos are resent until data arrives, repeats are ignored
+        """
+        if nbytes < _UDP_HELLO.size or addr in self.senders:
+            return
+        _, direction, rate_kbps, size, duration, batch = _UDP_HELLO.unpack_from(data)
+        if direction not in (DIRECTIONS["reverse"], DIRECTIONS["bidir"]) or not rate_kbps:
+            return
+        if self.sock is None:
+            self.log.log_error(f"Reverse stream requested by {addr} is not supported here")
+            return
+        size = min(max(size, _HEADER.size), UDP_PACKET_SIZE)
+        stop = self.senders[addr] = threading.Event()
+        threading.Thread(target=_udp_reverse_sender, name="reverse", daemon=True,
+                         args=(self.log, self.sock, addr, rate_kbps, size, max(duration, 1),
+                               min(max(batch, 1), 64), self.interval, stop, self.senders,
+                               self.control.reverse(addr) if self.control else None)).start()
+
+    @staticmethod
+    def _sack(stats: ClientStats) -> bytes:
+        """Build the selective ACK for everything 'stats' has received so far"""
+        seq = stats.seq
+        now = time.time()
+        stats.sack_base = seq.highest
+        stats.sack_count = 0
+        stats.sack_time = now
+        return _SACK.pack(SACK_ID, seq.highest, seq.bitmap(),
+                          stats.high_sent, stats.high_arrival, now)
+
+# ---------------------- UDP client ack tracking ----------------------
+
+class PendingAcks:
+    """
+    Send timestamps of datagrams still waiting for an ACK
+    - IDs are sent in increasing order, so the send time of ID 'pid' lives in
+      an array('d') ring at index pid & mask, and 0.0 marks a settled slot
+    - expire() walks forward from the oldest ID and stops at the first one
+      that has not timed out, so each ID is visited once in total: O(expired)
+      per call instead of a scan over everything in flight
+    - The ring doubles when more IDs are in flight than it can hold
+    """
+
+    def __init__(self, capacity: int = 1 << 16):
+        capacity = 1 << max(4, (capacity - 1).bit_length())
+        self.times = array('d', bytes(8 * capacity))
+        self.mask = capacity - 1
+        self.oldest = 1       # lowest ID that may still be pending
+        self.next_id = 1      # one past the newest ID added
+        self.outstanding = 0
+
+    def __len__(self) -> int:
+        return self.outstanding
+
+    def add(self, packet_id: int, send_ts: float) -> None:
+        """Record the send time of the next datagram"""
+        if packet_id - self.oldest > self.mask:
+            self._grow()
+        self.times[packet_id & self.mask] = send_ts
+        self.next_id = packet_id + 1
+        self.outstanding += 1
+
+    def pop(self, packet_id: int) -> Optional[float]:
+        """Settle an ACK; returns the send time, or None if not pending (dup / expired)"""
+        if not self.oldest <= packet_id < self.next_id:
+            return None
+        index = packet_id & self.mask
+        send_ts = self.times[index]
+        if send_ts == 0.0:
+            return None
+        self.times[index] = 0.0
+        self.outstanding -= 1
+        return send_ts
+
+    def expire(self, now: float, timeout: float) -> int:
+        """Drop the datagrams pending for 'timeout' seconds or more; returns how many"""
+        times, mask = self.times, self.mask
+        oldest, next_id = self.oldest, self.next_id
+        lost = 0
+        while oldest < next_id:
+            send_ts = times[oldest & mask]
+            if send_ts != 0.0:
+                if now - send_ts < timeout:
+                    break       # everything after this was sent later still
+                times[oldest & mask] = 0.0
+                lost += 1
+            oldest += 1
+        self.oldest = oldest
+        self.outstanding -= lost
+        return lost
+
+    def _grow(self) -> None:
+        capacity = (self.mask + 1) * 2
+        times = array('d', bytes(8 * capacity))
+        for pid in range(self.oldest, self.next_id):
+            times[pid & (capacity - 1)] = self.times[pid & self.mask]
+        self.times = times
+        self.mask = capacity - 1
+
+
+class OneWayDelay:
+    """
+    One-way delays and clock offset from ACK timestamps, NTP style
+    - Each ACK gives t1 (client send), t2 (server receive), t3 (server send)
+      and t4 (client receive): delay = (t4 - t1) - (t3 - t2) and
+      offset = ((t2 - t1) + (t3 - t4)) / 2 (server clock minus client clock)
+    - Queueing only adds delay, so the lowest-delay sample has the most
+      trustworthy offset: the estimate comes from the minimum-delay sample
+      of each of the last FILTER intervals (NTP's clock filter)
+    - Forward / reverse delays are the interval means of t2 - t1 and t4 - t3
+      corrected by that offset; per-direction jitter is the RFC 3550 estimator
+      on the raw values, where the constant offset cancels out
+    - Like NTP this assumes the uncongested path is symmetric: a fixed
+      asymmetry reads as clock offset, while queueing added on one side
+      shows up as delay and jitter in that direction
+    """
+
+    FILTER = 8
+
+    __slots__ = ('count', 'fwd_sum', 'rev_sum', 'best_delay', 'best_offset',
+                 'minima', 'last_fwd', 'last_rev', 'fwd_jitter', 'rev_jitter')
+
+    def __init__(self):
+        self.count = 0
+        self.fwd_sum = 0.0      # sum of t2 - t1 this interval
+        self.rev_sum = 0.0      # sum of t4 - t3 this interval
+        self.best_delay = math.inf
+        self.best_offset = 0.0
+        self.minima = deque(maxlen=OneWayDelay.FILTER)   # (delay, offset) per interval
+        self.last_fwd = None
+        self.last_rev = None
+        self.fwd_jitter = 0.0
+        self.rev_jitter = 0.0
+
+    def add(self, t1: float, t2: float, t3: float, t4: float) -> None:
+        fwd = t2 - t1
+        rev = t4 - t3
+        self.count += 1
+        self.fwd_sum += fwd
+        self.rev_sum += rev
+        delay = fwd + rev
+        if delay < self.best_delay:
+            self.best_delay = delay
+            self.best_offset = (fwd - rev) / 2
+        if self.last_fwd is not None:
+            self.fwd_jitter += (abs(fwd - self.last_fwd) - self.fwd_jitter) / 16
+            self.rev_jitter += (abs(rev - self.last_rev) - self.rev_jitter) / 16
+        self.last_fwd = fwd
+        self.last_rev = rev
+
+    def interval(self) -> dict:
+        """log_stat() keyword arguments (ms) for the interval, then start a new one"""
+        if not self.count:
+            return {}
+        self.minima.append((self.best_delay, self.best_offset))
+        offset = min(self.minima)[1]
+        metrics = {
+            'fwd_delay': (self.fwd_sum / self.count - offset) * 1000.0,
+            'rev_delay': (self.rev_sum / self.count + offset) * 1000.0,
+            'fwd_jitter': self.fwd_jitter * 1000.0,
+            'rev_jitter': self.rev_jitter * 1000.0,
+            'clock_offset': offset * 1000.0
+        }
+        self.count = 0
+        self.fwd_sum = self.rev_sum = 0.0
+        self.best_delay = math.inf
+        return metrics
+
+# ---------------------- UDP reverse mode ----------------------
+
+def udp_send_paced(log: Logger, sender: UdpSender, pacer: Pacer, ip: str, port: int,
+                   duration: int, interval: int, target_mbps: float,
+                   label: Optional[str] = None,
+                   stop: Optional[threading.Event] = None,
+                   results: Optional[list] = None) -> int:
+    """Send numbered datagrams (IDs from 1) through 'sender' as 'pacer' allows
+    - Runs for 'duration' seconds or until 'stop' is set
+    - Logs the achieved vs requested send rate every 'interval' (and appends
+      it to 'results' for a --control session)
+    - Returns the number of datagrams sent; the caller sends the ID 0
+    """
+    packet_id = 1
+    start_time = last_time = time.time()
+    packets_sent = 0
+    interval_packets = 0
+    phases = sender.phases
+
+    while time.time() - start_time < duration and not (stop and stop.is_set()):
+        due = pacer.wait()    # sleep until the next packet(s) are due
+        try:
+            sent = sender.send(packet_id, due)
+            packet_id += sent
+            packets_sent += sent
+            interval_packets += sent
+        except BlockingIOError:
+            sent = due     # non-blocking socket is full (asyncio server), drop the slot
+        except Exception as e:
+            log.log_error(f"Error: {e}")
+            sent = due     # skip the slot instead of retrying it forever
+        pacer.done(sent)
+
+        currentTime = time.time()
+        if currentTime - last_time >= interval:    # report achieved vs requested rate
+            send_rate = interval_packets * sender.packet_size * 8 / (currentTime - last_time) / 1e6
+            log.log_stat(
+                timestamp=currentTime,
+                ip=ip,
+                port=port,
+                send_rate=send_rate,
+                target_rate=target_mbps,
+                label=label
+            )
+            if results is not None:
+                results.append((currentTime, send_rate, target_mbps))
+            interval_packets = 0
+            last_time = currentTime
+        if phases is not None:
+            phases.tick(log)
+    return packets_sent
+
+
+def _udp_reverse_sender(log: Logger, sock: socket.socket, addr: tuple, rate_kbps: int,
+                        packet_size: int, duration: int, batch: int, interval: int,
+                        stop: threading.Event, senders: dict,
+                        results: Optional[list] = None) -> None:
+    """Server side of UDP -R / --bidir, run in its own thread
+    - Paces the stream to 'addr' out of the server's own socket, then sends
+      ID 0 a few times since it may be lost
+    """
+    log.log_info(f"Sending reverse stream to {addr} at {rate_kbps} Kbps for {duration}s")
+    sender = UdpSender(sock, addr[0], addr[1], packet_size, batch)
+    pacer = Pacer(rate_kbps * 1000 / (packet_size * 8))
+    try:
+        packets = udp_send_paced(log, sender, pacer, addr[0], addr[1], duration, interval,
+                                 rate_kbps / 1000, label="reverse", stop=stop,
+                                 results=results)
+        for _ in range(3):
+            sender.send_one(0)
+        log.log_info(f"Reverse stream to {addr} finished ({packets} datagrams)")
+    except OSError as e:
+        log.log_error(f"Reverse stream to {addr} failed: {e}")
+    finally:
+        senders.pop(addr, None)
+
+
+def udp_receive_reverse(log: Logger, sock: socket.socket, server_addr: tuple,
+                        hello: bytes, duration: int, interval: int, rate_kbps: int,
+                        packet_size: int, batch: int) -> None:
+    """Client side of UDP -R / --bidir: receive and report the server's stream
+    - Resends 'hello' every HELLO_RETRY seconds until the first datagram arrives
+    - Loss / jitter / reordering as on the server (ClientStats), logged as "reverse"
+    - Stops at the server's ID 0, or 2 seconds after 'duration' if it is lost
+    """
+    receiver = UdpReceiver(sock, UDP_PACKET_SIZE, batch, timestamps=True)
+    slots, lengths, addrs, times = receiver.slots, receiver.lengths, receiver.addrs, receiver.times
+    expected_interval = (packet_size * 8) / (rate_kbps * 1000)
+    start_time = time.time()
+    deadline = start_time + duration + 2
+    stats = None
+    sock.sendto(hello, server_addr)
+    hello_time = start_time
+
+    while True:
+        now = time.time()
+        if now >= deadline:
+            if stats is None:
+                log.log_error("No reverse stream from the server (does it support -R?)")
+            break
+        if stats is None and now - hello_time >= HELLO_RETRY:
+            sock.sendto(hello, server_addr)   # the hello or the first datagrams were lost
+            hello_time = now
+        if not select.select([sock], [], [], HELLO_RETRY)[0]:
+            continue
+        try:
+            count = receiver.recv()
+        except (BlockingIOError, InterruptedError):
+            continue
+        now = time.time()
+        finished = False
+        for i in range(count):
+            if addrs[i] != server_addr or lengths[i] < 4:
+                continue
+            packet_id = _ID.unpack_from(slots[i])[0]
+            if packet_id == 0:
+                finished = True
+                break
+            if stats is None:
+                stats = ClientStats(now)
+            sent = _HEADER.unpack_from(slots[i])[1] if lengths[i] >= _HEADER.size else 0.0
+            stats.update(packet_id, lengths[i], times[i] or now, expected_interval, sent)
+        if stats is not None and (finished or now - stats.last_time >= interval):
+            if stats.count or (finished and stats.seq.pending):
+                stats.report(log, server_addr, now, label="reverse", final=finished)
+        if finished:
+            break
+
 # ---------------------- UDP stubs (Tasks 3 & 4) ----------------------
 
 
 def tester_udp_client(log: Logger, server_ip: str, server_port: int,
                       duration: int, interval: int,
-                      rate_kbps: int, ack: bool) -> None:
+                      rate_kbps: int, ack: bool, batch: int = 1,
+                      packet_size: int = UDP_PACKET_SIZE,
+                      direction: str = "forward", control: bool = False) -> None:
     """UDP client
     Task 3 (ack == False):
       - Send datagrams at 'rate_kbps'
       - First 4 bytes = big-endian ID; start at 1; send ID=0 to end
       - Client may log sending rate, but server computes metrics
     Task 4 (ack == True):
-      - Receive acks (ID + server receive timestamp)
-      - Compute client-side BW / loss (via timeout) / jitter from acks and log
+      - Receive acks (ID + echoed send time + server receive / send times)
+      - Compute client-side BW / loss (via timeout) / jitter from acks and log,
+        plus one-way delays, per-direction jitter and clock offset (OneWayDelay)
+    Both modes send through UdpSender, up to 'batch' datagrams per syscall,
+    paced against absolute deadlines by Pacer. Datagrams are 'packet_size'
+    bytes (at most UDP_PACKET_SIZE, which is what the server receives).
+    With direction "reverse" (-R) a hello asks the server to send the stream
+    and we measure it (udp_receive_reverse), "bidir" does both at once;
+    neither is supported with acks.
+    With 'control' the test is first negotiated with the server (control_open)
+    and the server's own interval reports are fetched and logged at the end.
     """
     log.log_info(f"Starting UDP client to {server_ip}:{server_port} "
-                 f"for {duration}s at {rate_kbps} Kbps (ack={ack})")
+                 f"for {duration}s at {rate_kbps} Kbps "
+                 f"(ack={ack}, batch={batch}, size={packet_size}"
+                 + (f", {direction})" if direction != "forward" else ")"))
     # Common setup (safe if left unused):
+    session = int.from_bytes(os.urandom(4), 'big') or 1  # keys our state on the server
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     # Do not forger to bind the client socket to a port if you want to receive ACKs
+    if ack or control or direction != "forward":
+        sock.bind(('', 0))  # binding the socket to any available port
+
+    ctrl = None
+    if control:     # the server learns our port, rate and packet size up front
+        try:
+            ctrl = control_open(log, server_ip, server_port, {
+                "proto": "udp", "rate": rate_kbps, "duration": duration,
+                "length": packet_size, "interval": interval, "direction": direction,
+                "ports": [sock.getsockname()[1]], "session": session})
+        except (OSError, ValueError) as e:
+            log.log_error(f"Control channel: {e}")
+            sock.close()
+            return None
 
-    packet_size = 1472
+    sender = UdpSender(sock, server_ip, server_port, packet_size, batch, session)
 
     packet_id = 1
     start_time = time.time()
     last_time = start_time
     total_bytes_sent = 0
+    packets_sent = 0
+    interval_packets = 0
 
-    pkt_interval = packet_size * 8 / (rate_kbps * 1000)
+    target_mbps = rate_kbps / 1000
+    pacer = Pacer(rate_kbps * 1000 / (packet_size * 8))
+    phases = sender.phases = pacer.phases = log.phases
 
     if not ack:
         # -------------------- Task 3: UDP without acks --------------------
@@ -298,29 +2676,34 @@ def tester_udp_client(log: Logger, server_ip: str, server_port: int,
         #       * every 'interval' seconds, optionally log sending rate
         #   - Send ID=0 to signal end; close socket
 
-        while time.time() - start_time < duration:
-            # converting id into big endian for transmission
-            header = struct.pack('!I', packet_id)
-
-            payload = b"X" * 1468  # creating the message
-            packet = header + payload
-
-            try:
-                sock.sendto(packet, (server_ip, server_port))
-                total_bytes_sent += len(packet)                     #sending packet and keeping track of bytes sent
-            except Exception as e:
-                log.log_error(f"Error: {e}")
-
-            currentTime = time.time()
-            time.sleep(pkt_interval)
-
-            packet_id += 1
-
-        packet_id = 0
-        header = struct.pack('!I', packet_id)
-        packet = header + payload  # sending termination packet to end transmission
-        sock.sendto(packet, (server_ip, server_port))
+        receiving = None
+        if direction != "forward":
+            hello = _UDP_HELLO.pack(HELLO_ID, DIRECTIONS[direction], rate_kbps,
+                                    packet_size, duration, batch)
+            reverse_args = (log, sock, sender.addr, hello, duration, interval,
+                            rate_kbps, packet_size, batch)
+            if direction == "reverse":
+                udp_receive_reverse(*reverse_args)
+            else:
+                receiving = threading.Thread(target=udp_receive_reverse, args=reverse_args,
+                                             name="reverse", daemon=True)
+                receiving.start()
+
+        if direction != "reverse":
+            packets_sent = udp_send_paced(log, sender, pacer, server_ip, server_port,
+                                          duration, interval, target_mbps)
+            total_bytes_sent = packets_sent * packet_size    # keeping track of bytes sent
+            elapsed = time.time() - start_time
+            log.log_info(f"Sent {packets_sent} datagrams in {elapsed:.2f}s "
+                         f"({packets_sent / elapsed:.0f} pps, "
+                         f"{total_bytes_sent * 8 / elapsed / 1e6:.2f} Mbps)")
+
+        sender.send_one(0)  # sending termination packet to end transmission
+        if receiving is not None:
+            receiving.join()    # until the server's ID 0 (or the grace period)
         sock.close()
+        if ctrl is not None:
+            control_results(log, ctrl, server_ip, server_port, start_time)
 
         return None
     else:
@@ -334,12 +2717,13 @@ def tester_udp_client(log: Logger, server_ip: str, server_port: int,
         #   - Every 'interval' seconds, log client-side BW/loss/jitter via log.report(...)
         #   - End with ID=0; close socket
 
-        sock.bind(('', 0))  # binding the socket to any available port
         sock.setblocking(False)  # making it non-blocking to receive ACKs without delaying packet sends
 
-        packet_size = 1472
-        
-        pending = {}  #holds pending packets with the key being id and value being the timestamp
+        pending = PendingAcks()  # send timestamps of packets still waiting for an ack
+        owd = OneWayDelay()      # one-way delays from the ack timestamps
+        # kernel receive times, so the time acks wait for us to poll them
+        # does not count as reverse delay
+        ancbufsize = _TS_SPACE if enable_rx_timestamps(sock) else 0
         acks_received_total = 0
         lost_packets_total = 0
 
@@ -354,40 +2738,70 @@ def tester_udp_client(log: Logger, server_ip: str, server_port: int,
 
         try:
             while time.time() - start_time < duration:
+                due = pacer.wait()    # sleep until the next packet(s) are due
                 send_start = time.time()
 
-                header = struct.pack('!I', packet_id)    #converting id into big endian for transmission
-                payload = b"X" * (packet_size - 4)       #creating the message
-                packet = header + payload
-
+                sent = due
                 try:
-                    sock.sendto(packet, (server_ip, server_port)) # store send timestamp in pending dict
-                    pending[packet_id] = send_start
-                    packet_id += 1
+                    sent = sender.send(packet_id, due)
+                    for pid in range(packet_id, packet_id + sent):
+                        pending.add(pid, send_start)  # store send timestamp until acked
+                    packet_id += sent
+                    packets_sent += sent
+                    interval_packets += sent
                 except Exception as e:
                     log.log_error(f"Error: {e}")
+                pacer.done(sent)
 
                 # To recieve all available acks 
+                if phases is not None:
+                    t0 = time.perf_counter_ns()
                 while True:
                     try:
-                        ack_data, _ = sock.recvfrom(12)  # ACK is 4B ID + 8B 
-                        if len(ack_data) < 12:
-                            continue
-
-                        ack_id, server_ts = struct.unpack('!Id', ack_data)
+                        # ACK is 4B ID + 3 x 8B timestamps, a SACK adds the bitmap
+                        ack_data, ancdata, _, _ = sock.recvmsg(_SACK.size, ancbufsize)
                         recv_time = time.time()
+                        ack_arrival = rx_timestamp(ancdata) or recv_time
+
+                        if len(ack_data) == _SACK.size and _ID.unpack_from(ack_data)[0] == SACK_ID:
+                            _, highest, bitmap, sent_ts, server_rx, server_tx = \
+                                _SACK.unpack(ack_data)
+                            # the highest ID was acked promptly, the rest waited
+                            # for the SACK, so only it gives an RTT sample
+                            send_ts = pending.pop(highest)
+                            settled = send_ts is not None
+                            bitmap &= ~(1 << (SACK_BITS - 1))
+                            base = highest - SACK_BITS + 1
+                            while bitmap:   # settle the other set bits in bulk
+                                low = bitmap & -bitmap
+                                bitmap ^= low
+                                if pending.pop(base + low.bit_length() - 1) is not None:
+                                    settled += 1
+                            acks_received_total += settled
+                            interval_acks_count += settled
+                            if send_ts is not None:
+                                interval_rtts.append(recv_time - send_ts)
+                                if sent_ts:
+                                    owd.add(sent_ts, server_rx, server_tx, ack_arrival)
+                            continue
 
-                        # If this ID isbnt pending, it's either duplicate or already marked lost so ignore and keep reading
-                        if ack_id not in pending:
+                        if len(ack_data) < _ACK.size:
                             continue
 
-                        # remove from pending and update counters
+                        ack_id, sent_ts, server_rx, server_tx = _ACK.unpack(ack_data)
+
+                        # remove from pending; if this ID isnt pending, it's either duplicate
+                        # or already marked lost so ignore and keep reading
                         send_ts = pending.pop(ack_id)
+                        if send_ts is None:
+                            continue
+
                         acks_received_total += 1
                         interval_acks_count += 1
 
                         rtt = recv_time - send_ts
                         interval_rtts.append(rtt)
+                        owd.add(sent_ts, server_rx, server_tx, ack_arrival)
 
                     except (BlockingIOError, InterruptedError, socket.timeout):
                         #if blockingIOerror is returned, it measns that there are no more packets to be sent hence break loop
@@ -395,6 +2809,9 @@ def tester_udp_client(log: Logger, server_ip: str, server_port: int,
                     except Exception as e:
                         log.log_error(f"Error receiving ACK: {e}")
                         break
+                if phases is not None:
+                    phases.add(PH_RECV, t0)     # draining and matching the acks
+                    phases.tick(log)
 
                 currentTime = time.time()
 
@@ -403,14 +2820,12 @@ def tester_udp_client(log: Logger, server_ip: str, server_port: int,
                     if elapsed <= 0:        # to prevent dividing by 0 in bandwith calc
                         elapsed = 1e-6 
                         
-                    newly_lost = 0
-                    for pid, ts in list(pending.items()):
-                        if currentTime - ts >= ack_timeout:                      # Check pending packets for timeouts and mark as lost
-                            newly_lost += 1
-                            lost_packets_total += 1
-                            del pending[pid]
+                    # Check the oldest pending packets for timeouts and mark as lost
+                    newly_lost = pending.expire(currentTime, ack_timeout)
+                    lost_packets_total += newly_lost
 
                     total_considered = interval_acks_count + newly_lost
+                    send_rate = interval_packets * packet_size * 8 / elapsed / 1e6
 
                     if total_considered > 0:
                         # Bandwidth based only on ACKed packets
@@ -436,21 +2851,19 @@ def tester_udp_client(log: Logger, server_ip: str, server_port: int,
                             port=server_port,
                             bandwidth=bandwidth,
                             loss=loss,
-                            jitter=jitter_ms
+                            jitter=jitter_ms,
+                            send_rate=send_rate,
+                            target_rate=target_mbps,
+                            **owd.interval()
                         )
 
                     # reset interval accumulators
                     interval_rtts = []
                     interval_acks_count = 0
+                    interval_packets = 0
                     last_report_time = currentTime
                     next_report_time = currentTime + interval
 
-                # try to stick to the desired sending rate
-                elapsed_send = time.time() - send_start
-                sleep_time = pkt_interval - elapsed_send
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-
         except KeyboardInterrupt:           # if keyboard interrupt is signaled, report time
             log.log_info("\nClient interrupted by user")
 
@@ -460,12 +2873,9 @@ def tester_udp_client(log: Logger, server_ip: str, server_port: int,
                 elapsed = 1e-6
 
             # Final pass over pending to mark losses
-            newly_lost = 0
-            for pid, ts in list(pending.items()): #looping for packet id and time the packet was setn
-                if currentTime - ts >= ack_timeout: # if packet has been waiting for too long (timeout) consider it lost
-                    newly_lost += 1
-                    lost_packets_total += 1
-                    del pending[pid]
+            # if a packet has been waiting for too long (timeout) consider it lost
+            newly_lost = pending.expire(currentTime, ack_timeout)
+            lost_packets_total += newly_lost
 
             total_considered = interval_acks_count + newly_lost # considered packets
 
@@ -490,24 +2900,32 @@ def tester_udp_client(log: Logger, server_ip: str, server_port: int,
                     port=server_port,
                     bandwidth=bandwidth,
                     loss=loss,
-                    jitter=jitter_ms
+                    jitter=jitter_ms,
+                    **owd.interval()
                 )
 
-        finally:                                    
-            header = struct.pack('!I', 0)       # then send termination packet
-            payload = b"X" * 1468
-            packet = header + payload
+        finally:
+            elapsed = time.time() - start_time
+            if elapsed > 0:
+                log.log_info(f"Sent {packets_sent} datagrams in {elapsed:.2f}s "
+                             f"({packets_sent / elapsed:.0f} pps)")
             try:
-                sock.sendto(packet, (server_ip, server_port))
+                sender.send_one(0)       # then send termination packet
             except:
                 pass  # Socket might already be closed
             sock.close()
+        if ctrl is not None:
+            control_results(log, ctrl, server_ip, server_port, start_time)
 
         return None
 
 
 
-def tester_udp_server(log: Logger, port: int, rate: int, interval: int, ack: bool,) -> None:
+def tester_udp_server(log: Logger, port: int, rate: int, interval: int, ack: bool,
+                      batch: int = 1, rcvbuf: Optional[int] = None,
+                      reuseport: bool = False, timestamps: bool = True,
+                      sack: int = 0, sack_ms: float = SACK_MS,
+                      idle_timeout: float = UDP_IDLE_TIMEOUT) -> None:
     """UDP server
     Task 3 (ack == False):
       - Receive datagrams from multiple clients (track by (ip,port))
@@ -515,256 +2933,841 @@ def tester_udp_server(log: Logger, port: int, rate: int, interval: int, ack: boo
       - Periodically log per-client metrics via log.report(...)
     Task 4 (ack == True):
       - Same as Task 3, plus send an ack for each received datagram:
-        4B ID (big-endian)
+        4B ID (big-endian), the client's send time, our receive and send times
+    Datagrams are read through UdpReceiver, up to 'batch' per syscall, into
+    preallocated buffers; 'rcvbuf' sets SO_RCVBUF to absorb bursts.
+    With 'reuseport' several servers can bind the same port (see --workers).
+    With 'timestamps', jitter uses kernel receive times (SO_TIMESTAMPNS) rather
+    than the time the batch reached Python. With 'sack', acks are selective
+    and cover many datagrams each (see UdpSessions).
+    Clients can negotiate their test over a control channel on TCP 'port'
+    (see ControlChannel); not with 'reuseport', the workers can't share it.
     """
-    log.log_info(f"Starting UDP server on port {port} (ack={ack})")
+    log.log_info(f"Starting UDP server on port {port} (ack={ack}, batch={batch}"
+                 + (f", sack={sack}/{sack_ms:g}ms)" if ack and sack else ")"))
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if reuseport:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    set_rcvbuf(log, sock, rcvbuf)
     sock.bind(("0.0.0.0", port))
+    receiver = UdpReceiver(sock, UDP_PACKET_SIZE, batch, timestamps)
+    if timestamps and not receiver.timestamps:
+        log.log_error("SO_TIMESTAMPNS is not available, jitter uses userspace receive times")
+    slots, lengths, addrs = receiver.slots, receiver.lengths, receiver.addrs
+    times = receiver.times
+    phases = receiver.phases = log.phases
+
+    control = None
+    if not reuseport:
+        control = ControlChannel(log, "udp", interval)
+        control.listen(port)
+    sessions = UdpSessions(log, rate, interval, ack, sack, sack_ms, sock=sock,
+                           control=control, idle_timeout=idle_timeout)
+    # a kernel receive timeout (unlike settimeout(), which makes the fd
+    # non-blocking under recvmmsg) wakes the loop to sweep idle sessions
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO,
+                    _TIMEVAL.pack(int(SWEEP_INTERVAL), int(SWEEP_INTERVAL % 1 * 1e6)))
+
+    # Task 3 and Task 4 share the loop below; with ack == True every
+    # received datagram is also acknowledged with 4B ID + 3 x 8B timestamps
 
-    clients = {}        # to log, and handle multiple clients
-    start_time = time.time()
-    last_time = start_time
+    while True:
+        # recieving a batch of packets and the adddresses they came from
+        try:
+            count = receiver.recv()
+        except BlockingIOError:     # nothing for SWEEP_INTERVAL
+            sessions.sweep(time.time())
+            continue
+        except Exception as e:
+            log.log_error(f"Error: {e}")
+            continue
 
-    if not ack:
-        # -------------------- Task 3: server-only metrics --------------------
-        # TODO:
-        #   - recvfrom(...) loop
-        #   - Parse ID from first 4B; update per-client stats
-        #   - When elapsed >= interval (per client), compute:
-        #       * bandwidth (bytes/elapsed)
-        #       * loss = 1 - (recv_count / (max_id - min_id + 1))
-        #       * jitter from consecutive arrival deltas
-        #     then log via: log.report("server", ip, port, bandwidth=..., loss=..., jitter=...)
+        currentTime = time.time()
 
-        while True:
-            # recieving packet and adddress which it came from, from socket
+        if phases is not None:
+            t0 = time.perf_counter_ns()
+        for i in range(count):
+            ack_packet = sessions.datagram(slots[i], lengths[i], addrs[i], currentTime,
+                                           times[i])
+            if ack_packet is not None:
+                try:
+                    sock.sendto(ack_packet, addrs[i])
+                except Exception as e:
+                    log.log_error(f"Error sending ACK: {e}")
+        if phases is not None:
+            phases.add(PH_PROCESS, t0)
+            phases.tick(log)
+
+    return None
+
+
+# ---------------------- Multi-core UDP server ----------------------
+
+class _WorkerLogger(Logger):
+    """
+    Logger used inside a worker process: instead of printing or writing CSV
+    it forwards every record to the parent over a multiprocessing queue
+    - Every method that would print or enqueue is overridden, so nothing
+      reaches the parent that isn't a (kind, record) pair
+    """
+
+    def __init__(self, parent_queue, worker: int, profile_interval: Optional[float] = None):
+        super().__init__(csv_output=None, profile_interval=profile_interval)
+        self.parent_queue = parent_queue    # not Logger.queue, the writer thread's
+        self.worker = worker
+
+    def log_stat(self, timestamp: float, ip: str, port: int, **metrics) -> None:
+        self.parent_queue.put(('stat', (timestamp, ip, port, metrics)))
+
+    def _print(self, text: str) -> None:
+        self.parent_queue.put(('print', text))
+
+    def log_info(self, message: str) -> None:
+        self.parent_queue.put(('info', f"[worker {self.worker}] {message}"))
+
+    def log_error(self, message: str) -> None:
+        self.parent_queue.put(('error', f"[worker {self.worker}] {message}"))
+
+    def log_success(self, message: str) -> None:
+        self.parent_queue.put(('success', f"[worker {self.worker}] {message}"))
+
+
+def _udp_server_worker(queue, worker: int, port: int, rate: int, interval: int,
+                       ack: bool, batch: int, rcvbuf: Optional[int],
+                       timestamps: bool, sack: int, sack_ms: float,
+                       idle_timeout: float, profile_interval: Optional[float]) -> None:
+    """Entry point of one worker process; runs a normal UDP server on a shared port"""
+    try:
+        tester_udp_server(_WorkerLogger(queue, worker, profile_interval), port, rate, interval, ack,
+                          batch, rcvbuf, reuseport=True, timestamps=timestamps,
+                          sack=sack, sack_ms=sack_ms, idle_timeout=idle_timeout)
+    except KeyboardInterrupt:
+        pass  # the parent handles Ctrl-C and prints the summary
+
+
+def tester_udp_server_workers(log: Logger, port: int, rate: int, interval: int,
+                              ack: bool, workers: int, batch: int = 1,
+                              rcvbuf: Optional[int] = None, timestamps: bool = True,
+                              sack: int = 0, sack_ms: float = SACK_MS,
+                              idle_timeout: float = UDP_IDLE_TIMEOUT) -> None:
+    """UDP server spread over 'workers' processes
+    - Every worker binds 'port' with SO_REUSEPORT, so the kernel hashes each
+      client flow (src ip, src port) onto one worker and its core
+    - Each worker keeps its own per-client state, exactly like the single
+      process server
+    - The parent merges the workers' per-interval stats into 'log'
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        log.log_error("SO_REUSEPORT is not supported on this platform")
+        return None
+
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    # --profile: each worker times its own loop and reports through the queue
+    profile = log.phases.interval_ns / 1e9 if log.phases is not None else None
+    procs = [ctx.Process(target=_udp_server_worker, daemon=True,
+                         args=(queue, i, port, rate, interval, ack, batch, rcvbuf,
+                               timestamps, sack, sack_ms, idle_timeout, profile))
+             for i in range(workers)]
+    for proc in procs:
+        proc.start()
+    log.log_info(f"Started {workers} UDP server workers on port {port}")
+
+    try:
+        while any(proc.is_alive() for proc in procs):
             try:
-                data, addr = sock.recvfrom(1472)
-            except Exception as e:
-                Logger.log_error(f"Error: {e}")
+                kind, record = queue.get(timeout=0.5)
+            except Exception:  # queue.Empty, check the workers are still alive
                 continue
+            if kind == 'stat':
+                timestamp, ip, port_, metrics = record
+                log.log_stat(timestamp, ip, port_, **metrics)
+            elif kind == 'info':
+                log.log_info(record)
+            elif kind == 'success':
+                log.log_success(record)
+            elif kind == 'print':
+                log._print(record)
+            else:
+                log.log_error(record)
+    except KeyboardInterrupt:
+        log.log_info("Server interrupted by user, stopping workers")
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.join()
 
-            header = data[:4]  # getting the first 4 bytes
-            packet_id = struct.unpack('!I', header)[0]
+    return None
 
-            currentTime = time.time()
+# ---------------------- Asyncio server engine ----------------------
 
-            if packet_id == 0:  # termination packet, so log data if there is any
-                log.log_info(f"Received termination datagram (ID 0) from {addr}: finishing UDP session")
-                if addr in clients and len(clients[addr]['packet_ids']) > 0:
-
-                    elapsed = currentTime - clients[addr]['last_time']
-                    # calulatin for current client by fetching its stats from dict
-                    bandwidth = (
-                        clients[addr]['total_bytes']/elapsed) * 8 / 1e6
-                    expected_interval = (1472 * 8) / (rate * 1000)
-
-                    arrival_times = clients[addr]['arrival_times']
-                    packet_ids = clients[addr]['packet_ids']
-
-                    loss = (1 - len(packet_ids) /
-                            (max(packet_ids) - min(packet_ids) + 1)) * 100
-                    # calulating loss per client
-                    total = 0
-                    if len(packet_ids) >= 2:  # needs at least two packets to calculate jitter
-                        for i in range(1, len(arrival_times)):
-                            gap = arrival_times[i] - arrival_times[i-1]
-                            total += abs(gap - expected_interval)
-
-                        jitter = (total / (len(arrival_times) - 1)) * 1000
-                    else:
-                        jitter = 0          # what if packet 1 and 2, 4 arrives and not 3?
-
-                    log.log_stat(
-                        timestamp=currentTime,
-                        ip=addr[0],
-                        port=addr[1],
-                        bandwidth=bandwidth,
-                        loss=loss,
-                        jitter=jitter
-                    )
-
-                    # Clean up client data
-                    del clients[addr]
-                continue
 
-            if addr not in clients:
-                clients[addr] = {
-                    'packet_ids': [],  
-                    'arrival_times': [],
-                    'total_bytes': 0,
-                    'start_time': time.time(),
-                    'last_time': time.time()
-                }
+class _TcpTestProtocol(asyncio.BufferedProtocol):
+    """
+    One TCP test client on the asyncio server
+    - Reads straight into the server's shared preallocated buffer
+      (the payload is discarded), only a byte counter is kept per connection
+    """
 
-            clients[addr]['packet_ids'].append(packet_id)
-            clients[addr]['arrival_times'].append(
-                currentTime)   # populate the client dicts
-            clients[addr]['total_bytes'] += len(data)
+    def __init__(self, server: '_AsyncioServer'):
+        self.server = server
+        self.stats = None
+        self.transport = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        addr = transport.get_extra_info('peername')[:2]
+        self.stats = TcpClientStats(addr, time.time())
+        self.server.control.attach(addr, self.stats)
+        self.server.connections.add(self.stats)
+        self.server.log.log_info(f"Client connected from {addr}")
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.server.buffer
+
+    def buffer_updated(self, nbytes: int) -> None:
+        if self.stats.fresh:    # first data: maybe a -R / --bidir hello
+            self.stats.fresh = False
+            hello = tcp_hello(self.server.log, self.transport.get_extra_info('socket'),
+                              self.server.buffer[:nbytes], self.server.interval,
+                              self.server.control)
+            if hello == HELLO_CONTROL:  # control connection, no longer ours
+                self.server.connections.discard(self.stats)
+                self.stats = None
+                self.transport.abort()
+                return
+            nbytes -= hello
+        self.stats.total_bytes += nbytes
+
+    def connection_lost(self, exc) -> None:
+        if self.stats is None:  # handed over to the control channel
+            return
+        self.server.connections.discard(self.stats)
+        self.stats.report(self.server.log, time.time())
+        self.server.control.finished(self.stats.addr)
+        self.server.log.log_info(f"Client {self.stats.addr} disconnected")
+
+
+class _UdpTestProtocol(asyncio.DatagramProtocol):
+    """UDP test traffic on the asyncio server, accounted by UdpSessions"""
+
+    def __init__(self, sessions: UdpSessions):
+        self.sessions = sessions
+        self.transport = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        ack_packet = self.sessions.datagram(data, len(data), addr, time.time())
+        if ack_packet is not None:
+            self.transport.sendto(ack_packet, addr)
+
+    def error_received(self, exc) -> None:
+        self.sessions.log.log_error(f"Error: {exc}")
+
+
+class _AsyncioServer:
+    """State shared by the asyncio protocols of one server"""
+
+    def __init__(self, log: Logger, interval: int, proto: str):
+        self.log = log
+        self.interval = interval
+        self.control = ControlChannel(log, proto, interval)
+        self.connections = set()      # TcpClientStats of the open connections
+        self.buffer = memoryview(bytearray(TCP_RECV_BUFFER))
+
+    async def run_tcp(self, port: int) -> None:
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: _TcpTestProtocol(self), "0.0.0.0", port,
+                                          reuse_address=True, backlog=4096)
+        async with server:
+            while True:   # per-client interval reports
+                await asyncio.sleep(self.interval)
+                now = time.time()
+                for stats in list(self.connections):
+                    stats.report(self.log, now)
+
+    async def run_udp(self, port: int, rate: int, ack: bool, rcvbuf: Optional[int],
+                      sack: int = 0, sack_ms: float = SACK_MS,
+                      idle_timeout: float = UDP_IDLE_TIMEOUT) -> None:
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        set_rcvbuf(self.log, sock, rcvbuf)
+        sock.bind(("0.0.0.0", port))
+        self.control.listen(port)
+        sessions = UdpSessions(self.log, rate, self.interval, ack, sack, sack_ms, sock=sock,
+                               control=self.control, idle_timeout=idle_timeout)
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _UdpTestProtocol(sessions), sock=sock)
+
+        def sweep() -> None:    # idle sessions go even when no datagram arrives
+            nonlocal timer
+            sessions.sweep(time.time())
+            timer = loop.call_later(SWEEP_INTERVAL, sweep)
+        timer = loop.call_later(SWEEP_INTERVAL, sweep)
+        try:
+            await asyncio.Future()    # serve until cancelled / interrupted
+        finally:
+            timer.cancel()
+            transport.close()
+
+
+def tester_asyncio_server(log: Logger, port: int, udp: bool, interval: int,
+                          rate: int = 1000, ack: bool = False,
+                          rcvbuf: Optional[int] = None, sack: int = 0,
+                          sack_ms: float = SACK_MS,
+                          idle_timeout: float = UDP_IDLE_TIMEOUT) -> None:
+    """TCP or UDP server on an asyncio event loop (--engine asyncio)
+    - Protocol callbacks instead of select(), so there is no FD_SETSIZE cap
+      and no O(n) rescan of the socket list: thousands of clients per process
+    - TCP: per-connection byte counters, per-client bandwidth every 'interval'
+    - UDP: same metrics and ACKs as tester_udp_server (shared UdpSessions)
+    - Runs on uvloop when it is installed
+    """
+    loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+    server = _AsyncioServer(log, interval, "udp" if udp else "tcp")
+    log.log_info(f"Starting {'UDP' if udp else 'TCP'} server on port {port} "
+                 f"(engine=asyncio{', uvloop' if uvloop is not None else ''})")
+    main = loop.create_task(server.run_udp(port, rate, ack, rcvbuf, sack, sack_ms,
+                                           idle_timeout) if udp
+                            else server.run_tcp(port))
+    try:
+        loop.run_until_complete(main)
+    except KeyboardInterrupt:
+        log.log_info("Server interrupted by user")
+        main.cancel()   # let the servers close their sockets before the loop goes
+        try:
+            loop.run_until_complete(main)
+        except asyncio.CancelledError:
+            pass
+    finally:
+        loop.close()
 
-            elapsed = currentTime - clients[addr]['last_time']
+    return None
 
-            if elapsed >= interval:  # when interval is reached report the log
-                bandwidth = (clients[addr]['total_bytes']/elapsed) * 8 / 1e6
-                expected_interval = (1472 * 8) / (rate * 1000)
+# ---------------------- Daemon mode ----------------------
 
-                arrival_times = clients[addr]['arrival_times']
-                packet_ids = clients[addr]['packet_ids']
+METRICS_ADDR = "127.0.0.1:9464"    # --daemon default: host:port, or a Unix socket path
+METRICS_STALE = 3                   # report intervals a client may miss before it is dropped
+METRICS_WINDOW = 60.0               # seconds of samples behind the quantiles
 
-                loss = (1 - len(packet_ids) /
-                        (max(packet_ids) - min(packet_ids) + 1)) * 100
 
-                total = 0
-                if len(packet_ids) >= 2:  # needs at least two packets to calculate jitter
-                    for i in range(1, len(arrival_times)):
-                        gap = arrival_times[i] - arrival_times[i-1]
-                        total += abs(gap - expected_interval)
+class _ClientMetrics:
+    """Exported state of one client: running counters and its latest report"""
 
-                    jitter = (total / (len(arrival_times) - 1)) * 1000
+    __slots__ = ('bytes', 'packets', 'lost', 'bandwidth', 'loss', 'jitter',
+                 'loop_latency', 'last_seen', 'period')
 
-                else:
-                    jitter = 0
+    def __init__(self, now: float):
+        self.bytes = 0
+        self.packets = 0
+        self.lost = 0
+        self.bandwidth = None     # bits/s, seconds and ratios once reported
+        self.loss = None
+        self.jitter = None
+        self.loop_latency = None
+        self.last_seen = now
+        self.period = 0.0         # gap between its last two reports
 
-                log.log_stat(
-                    timestamp=currentTime,
-                    ip=addr[0],
-                    port=addr[1],
-                    bandwidth=bandwidth,
-                    loss=loss,
-                    jitter=jitter
-                )
 
-                clients[addr]['total_bytes'] = 0
-                clients[addr]['packet_ids'] = []  # resetting
-                clients[addr]['arrival_times'] = []
-                clients[addr]['last_time'] = currentTime
+class _WindowSketch:
+    """
+    Quantiles over roughly the last METRICS_WINDOW seconds
+    - Two QuantileSketches, swapped every window and merged for reading, so
+      old samples age out without keeping them
+    - sum / count are cumulative, as Prometheus summaries expect
+    """
 
-        return None
-    else:
-        # -------------------- Task 4: add acknowledgements --------------------
-        # TODO:
-        #   - Same as above, and for each received datagram:
-        #       * Build ack: 4B ID + timestamp (e.g., float via struct.pack)
-        #       * sendto(ack, (ip, port))
-        #   - Continue periodic logging as in Task 3
+    __slots__ = ('current', 'previous', 'started', 'sum', 'count')
+
+    def __init__(self, now: float):
+        self.current = QuantileSketch()
+        self.previous = QuantileSketch()
+        self.started = now
+        self.sum = 0.0
+        self.count = 0
+
+    def add(self, value: float, now: float) -> None:
+        if now - self.started >= METRICS_WINDOW:
+            self.previous = self.current
+            self.current = QuantileSketch()
+            self.started = now
+        self.current.add(value)
+        self.sum += value
+        self.count += 1
+
+    def quantiles(self) -> list:
+        merged = QuantileSketch()
+        merged.merge(self.previous)
+        merged.merge(self.current)
+        return [(q, merged.quantile(q)) for q in Logger.PERCENTILES]
+
+
+def _prom(value) -> str:
+    """A sample value in the Prometheus text format"""
+    if value is None:
+        return "NaN"
+    if isinstance(value, int):
+        return str(value)
+    return f"{value:.9g}"
+
+
+class ServerMetrics:
+    """
+    Server metrics for --daemon, exported in the Prometheus text format
+    - add() is called by Logger.log_stat once per client report, never per
+      packet, so the receive loops pay nothing for it
+    - A snapshot thread renders the text every 'interval' into self.text;
+      scrapes only read that, however often they come
+    - A client that has not reported for METRICS_STALE of its intervals is
+      dropped, so the per-client series stay bounded on a long-running server;
+      the active session gauge counts the clients left
+    """
 
+    def __init__(self, interval: float):
+        now = time.time()
+        self.interval = interval
+        self.started = now
+        self.lock = threading.Lock()
+        self.clients = {}           # (ip, port) -> _ClientMetrics
+        self.bytes = 0
+        self.packets = 0
+        self.lost = 0
+        self.jitter = _WindowSketch(now)
+        self.loop_latency = _WindowSketch(now)
+        self.text = self.render(now)
+        self.server = None          # the HTTP server, set by start_daemon
+        self.path = None            # its Unix socket, if it listens on one
+
+    def add(self, ip: str, port: int, timestamp: float, bandwidth: Optional[float],
+            loss: Optional[float], jitter: Optional[float], lost: Optional[int],
+            nbytes: Optional[int], packets: Optional[int],
+            loop_latency: Optional[float]) -> None:
+        """Account for one interval report (log_stat units: Mbps, %, ms)"""
+        with self.lock:
+            client = self.clients.get((ip, port))
+            if client is None:
+                client = self.clients[(ip, port)] = _ClientMetrics(timestamp)
+            client.period = timestamp - client.last_seen
+            client.last_seen = timestamp
+            if nbytes is not None:
+                client.bytes += nbytes
+                self.bytes += nbytes
+            if packets is not None:
+                client.packets += packets
+                self.packets += packets
+            if lost is not None:
+                client.lost += lost
+                self.lost += lost
+            if bandwidth is not None:
+                client.bandwidth = bandwidth * 1e6
+            if loss is not None:
+                client.loss = loss / 100
+            if jitter is not None:
+                client.jitter = jitter / 1000
+                self.jitter.add(client.jitter, timestamp)
+            if loop_latency is not None:
+                client.loop_latency = loop_latency / 1000
+                self.loop_latency.add(client.loop_latency, timestamp)
+
+    def render(self, now: float) -> bytes:
+        """Drop stale clients and format every metric"""
+        with self.lock:
+            for key, client in list(self.clients.items()):
+                if now - client.last_seen > METRICS_STALE * max(self.interval, client.period):
+                    del self.clients[key]
+            clients = [(f"{ip}:{port}", client.bytes, client.packets, client.lost,
+                        client.bandwidth, client.loss, client.jitter, client.loop_latency)
+                       for (ip, port), client in self.clients.items()]
+            received, packets, lost = self.bytes, self.packets, self.lost
+            summaries = [(name, sketch.quantiles(), sketch.sum, sketch.count)
+                         for name, sketch in (("jitter", self.jitter),
+                                              ("loop_latency", self.loop_latency))]
+
+        lines = []
+
+        def metric(name: str, kind: str, text: str, samples) -> None:
+            lines.append(f"# HELP nettester_{name} {text}")
+            lines.append(f"# TYPE nettester_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"nettester_{name}{labels} {_prom(value)}")
+
+        metric("uptime_seconds", "gauge", "Seconds since the server started",
+               [("", now - self.started)])
+        metric("active_sessions", "gauge", "Clients that reported recently",
+               [("", len(clients))])
+        metric("received_bytes_total", "counter", "Bytes received from all clients",
+               [("", received)])
+        metric("received_packets_total", "counter", "UDP datagrams received from all clients",
+               [("", packets)])
+        metric("lost_packets_total", "counter", "UDP datagrams lost, all clients",
+               [("", lost)])
+        metric("loss_ratio", "gauge", "Lost over expected UDP datagrams since start",
+               [("", lost / (lost + packets) if lost + packets > 0 else 0.0)])
+        for name, quantiles, total, count in summaries:
+            text = ("Per-client interval jitter" if name == "jitter" else
+                    "Kernel receive to processing delay per UDP datagram")
+            metric(f"{name}_seconds", "summary", f"{text}, last {METRICS_WINDOW:g}s",
+                   [(f'{{quantile="{q:g}"}}', value) for q, value in quantiles])
+            lines.append(f"nettester_{name}_seconds_sum {_prom(total)}")
+            lines.append(f"nettester_{name}_seconds_count {count}")
+
+        for index, (name, kind, text) in enumerate((
+                ("client_received_bytes_total", "counter", "Bytes received from the client"),
+                ("client_received_packets_total", "counter", "UDP datagrams received from the client"),
+                ("client_lost_packets_total", "counter", "UDP datagrams lost by the client"),
+                ("client_bandwidth_bits_per_second", "gauge", "Bandwidth of the last interval"),
+                ("client_loss_ratio", "gauge", "UDP loss of the last interval"),
+                ("client_jitter_seconds", "gauge", "UDP jitter of the last interval"),
+                ("client_loop_latency_seconds", "gauge",
+                 "Mean receive delay of the last interval"))):
+            samples = [(f'{{client="{row[0]}"}}', row[index + 1]) for row in clients
+                       if row[index + 1] is not None]
+            metric(name, kind, text, samples)
+        return ("\n".join(lines) + "\n").encode()
+
+    def run(self) -> None:
+        """Snapshot thread: re-render every interval"""
         while True:
-            # recieving packet and adddress which it came from from socket
+            time.sleep(self.interval)
+            self.text = self.render(time.time())
+
+    def close(self) -> None:
+        """Stop serving and remove the Unix socket file"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.path is not None:
             try:
-                data, addr = sock.recvfrom(1472)
-            except Exception as e:
-                log.log_error(f"Error: {e}")
-                continue
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
 
-            currentTime = time.time()
-            if len(data) < 4:  #if the datagram is less than 4 bytes it cant contain a valid packet id
-                continue
 
-            header = data[:4]  # getting the first 4 bytes
-            packet_id = struct.unpack('!I', header)[0]
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """GET /metrics (or /) returns the latest snapshot"""
 
-            # Build ack: 4B ID + 8B server timestamp 
-            ack = struct.pack('!Id', packet_id, currentTime)
-            try:
-                sock.sendto(ack, addr)
-            except Exception as e:
-                log.log_error(f"Error sending ACK: {e}")
-
-            if packet_id == 0:  # if termination packet is sent
-                # calculating stats per client to report in log
-                log.log_info(f"Received termination datagram (ID 0) from {addr}: finishing UDP session")
-                if addr in clients and len(clients[addr]['packet_ids']) > 0:
-                    elapsed = currentTime - clients[addr]['last_time']
-                    if elapsed <= 0:
-                        elapsed = 1e-6
-
-                    bandwidth = (clients[addr]['total_bytes']/elapsed) * 8 / 1e6
-                    expected_interval = (1472 * 8) / (rate * 1000)
-
-                    arrival_times = clients[addr]['arrival_times']
-                    packet_ids = clients[addr]['packet_ids']
-
-                    loss = (1 - len(packet_ids) /
-                            (max(packet_ids) - min(packet_ids) + 1)) * 100
-
-                    total = 0.0
-
-                    if len(arrival_times) >= 2:  # needs at least two packets to calculate jitter
-                        for i in range(1, len(arrival_times)):
-                            gap = arrival_times[i] - arrival_times[i-1]
-                            total += abs(gap - expected_interval)
-
-                        jitter = (total / (len(arrival_times) - 1)) * 1000.0
-                    else:
-                        jitter = 0.0
-
-                    log.log_stat(
-                        timestamp=currentTime,
-                        ip=addr[0],
-                        port=addr[1],
-                        bandwidth=bandwidth,
-                        loss=loss,
-                        jitter=jitter
-                    )
-
-                    del clients[addr]  # reset data
-                continue
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.server.metrics.text
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
-            if addr not in clients:  # create new client if it does not exist yet
-                clients[addr] = {
-                    'packet_ids': [],
-                    'arrival_times': [],
-                    'total_bytes': 0,
-                    'start_time': currentTime,
-                    'last_time': currentTime
-                }
+    def log_message(self, format, *args) -> None:
+        pass    # scrapes every few seconds would drown the interval reports
 
-            clients[addr]['packet_ids'].append(packet_id)
-            clients[addr]['arrival_times'].append(currentTime)
-            clients[addr]['total_bytes'] += len(data)
 
-            elapsed = currentTime - clients[addr]['last_time']
+class _UnixMetricsServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
 
-            if elapsed >= interval:  # when interval is reached report the log
-                if elapsed <= 0:
-                    elapsed = 1e-6
 
-                bandwidth = (clients[addr]['total_bytes']/elapsed) * 8 / 1e6
-                expected_interval = (1472 * 8) / (rate * 1000)
+def start_daemon(log: Logger, address: str, interval: float) -> ServerMetrics:
+    """Feed 'log' records into a ServerMetrics and serve it (--daemon)
+    - 'address' is host:port for HTTP over TCP, or a path for a Unix socket
+    - Raises OSError / ValueError when the address can't be used; an existing
+      file at the path is only replaced if it is a socket (a previous run's)
+    """
+    metrics = ServerMetrics(interval)
+    if address.startswith("/"):
+        try:
+            if not stat.S_ISSOCK(os.lstat(address).st_mode):
+                raise ValueError(f"{address} exists and is not a socket")
+            os.unlink(address)      # left over by a previous run
+        except FileNotFoundError:
+            pass
+        server = _UnixMetricsServer(address, _MetricsHandler)
+        metrics.path = address
+        where = f"unix:{address}"
+    else:
+        host, _, port = address.rpartition(":")
+        server = http.server.ThreadingHTTPServer((host or "0.0.0.0", int(port)),
+                                                 _MetricsHandler)
+        where = f"http://{host or '0.0.0.0'}:{port}/metrics"
+    server.metrics = metrics
+    metrics.server = server
+    log.metrics = metrics
+    threading.Thread(target=metrics.run, name="metrics", daemon=True).start()
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    log.log_info(f"Serving Prometheus metrics on {where}")
+    return metrics
+
+
+# ---------------------- Memory micro-benchmark ----------------------
+
+class _DictStat:
+    """Logger.Stat as it was before __slots__, kept only for membench()"""
+
+    def __init__(self, timestamp, bandwidth=None, loss=None, jitter=None, label=None):
+        self.timestamp = timestamp
+        self.label = label
+        self.bandwidth = bandwidth
+        self.loss = loss
+        self.jitter = jitter
+
+
+def _measure(build) -> int:
+    """Bytes still allocated by build() (it must return what it built)"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return after - before
+
+
+def membench(log: Logger, records: int = 100000, clients: int = 1000,
+             packets: int = 500) -> None:
+    """Memory per measurement record and per UDP server client (--membench)
+    - records: list of dict-based Stat objects vs __slots__ Stat vs StatStore
+    - clients: the old dict-of-lists client state after 'packets' datagrams
+      in an interval vs ClientStats, which does not grow with packets
+    """
+    now = time.time()
+
+    def dict_stats():
+        return [_DictStat(now + i, 10.0, 0.5, 0.1) for i in range(records)]
+
+    def slot_stats():
+        return [Logger.Stat(now + i, 10.0, 0.5, 0.1) for i in range(records)]
+
+    def store_stats():
+        store = StatStore()
+        for i in range(records):
+            store.append(Logger.Stat(now + i, 10.0, 0.5, 0.1))
+        return store
+
+    log.log_info(f"Memory per measurement record ({records} records):")
+    for name, build in (("list of dict Stat", dict_stats),
+                        ("list of __slots__ Stat", slot_stats),
+                        ("StatStore arrays", store_stats)):
+        log.log_info(f"  {name:<24} {_measure(build) / records:8.1f} bytes")
+
+    def dict_clients():
+        table = {}
+        for c in range(clients):
+            table[("10.0.0.1", c)] = {
+                'packet_ids': list(range(1, packets + 1)),
+                'arrival_times': [now + i * 1e-3 for i in range(packets)],
+                'total_bytes': packets * UDP_PACKET_SIZE,
+                'start_time': now,
+                'last_time': now
+            }
+        return table
+
+    def stream_clients():
+        table = {}
+        for c in range(clients):
+            stats = table[("10.0.0.1", c)] = ClientStats(now)
+            for i in range(1, packets + 1):
+                stats.update(i, UDP_PACKET_SIZE, now + i * 1e-3, 1e-3)
+        return table
+
+    log.log_info(f"Memory per UDP server client ({clients} clients, "
+                 f"{packets} packets in the interval):")
+    for name, build in (("dict of lists", dict_clients),
+                        ("ClientStats", stream_clients)):
+        log.log_info(f"  {name:<24} {_measure(build) / clients:8.1f} bytes")
 
-                arrival_times = clients[addr]['arrival_times']
-                packet_ids = clients[addr]['packet_ids']
+    return None
 
-                loss = (1 - len(packet_ids) /
-                        (max(packet_ids) - min(packet_ids) + 1)) * 100
+# ---------------------- Benchmark suite ----------------------
 
-                total = 0.0
-                if len(arrival_times) >= 2:  # needs at least two packets to calculate jitter
-                    for i in range(1, len(arrival_times)):
-                        gap = arrival_times[i] - arrival_times[i-1]
-                        total += abs(gap - expected_interval)
+BENCH_FIELDS = ['proto', 'engine', 'clients', 'rate_kbps', 'packet_size', 'netns',
+                'target_mbps', 'sent_mbps', 'received_mbps', 'achieved_percent',
+                'loss_percent', 'server_cpu_percent', 'client_cpu_percent']
+BENCH_NETNS = "nt-bench"
+BENCH_VETH = ("ntb0", "ntb1")
+BENCH_ADDRS = ("10.199.0.1", "10.199.0.2")  # host side, namespace side
+BENCH_STARTUP = 0.5     # seconds to let the server bind before clients start
+BENCH_SHUTDOWN = 5.0    # seconds to wait for the server after SIGINT
 
-                    jitter = (total / (len(arrival_times) - 1)) * 1000.0
 
-                else:
-                    jitter = 0.0
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",")]
 
-                log.log_stat(
-                    timestamp=currentTime,
-                    ip=addr[0],
-                    port=addr[1],
-                    bandwidth=bandwidth,
-                    loss=loss,
-                    jitter=jitter
-                )
 
-                clients[addr]['total_bytes'] = 0
-                clients[addr]['packet_ids'] = []        # resetting
-                clients[addr]['arrival_times'] = []
-                clients[addr]['last_time'] = currentTime
+def _bench_cmd(*args: str) -> List[str]:
+    return [sys.executable, os.path.abspath(__file__), *args]
 
-        return None
 
+def _bench_wait(proc: subprocess.Popen, timeout: Optional[float] = None) -> float:
+    """Reap a child with wait4 and return the CPU seconds it used (user + sys)
+    - After 'timeout' seconds the child is killed (still reaped and counted)
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        pid, status, usage = os.wait4(proc.pid, 0 if deadline is None else os.WNOHANG)
+        if pid:
+            break
+        if time.monotonic() > deadline:
+            proc.kill()
+            deadline = None
+        else:
+            time.sleep(0.05)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _bench_mean(path: str, column: str, streams=("",),
+                interval: float = 1.0) -> Optional[float]:
+    """Sum over (ip, port) of the time-weighted mean of 'column' in a Logger CSV
+    - Each row is weighted by the time since the peer's previous row (the
+      first by 'interval'), so for bandwidth this is total bytes over time
+    - A last row shorter than 'interval' is dropped: the report logged at
+      termination can cover a few datagrams in well under a millisecond
+    - Only rows whose stream label is in 'streams' count (SUM rows for -P)
+    """
+    per_peer = {}
+    try:
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                if row[column] and row['stream'] in streams:
+                    per_peer.setdefault((row['ip'], row['port']), []).append(
+                        (float(row['timestamp']), float(row[column])))
+    except FileNotFoundError:
+        return None
+    total = None
+    for rows in per_peer.values():
+        rows.sort()
+        weighted = weights = 0.0
+        previous = rows[0][0] - interval
+        for index, (timestamp, value) in enumerate(rows):
+            dt = timestamp - previous
+            previous = timestamp
+            if index == len(rows) - 1 and index and dt < interval:
+                break   # partial tail interval
+            weighted += value * dt
+            weights += dt
+        if weights > 0:
+            total = (total or 0.0) + weighted / weights
+    return total
+
+
+def _bench_netns(log: Logger, up: bool) -> None:
+    """Create (or delete) the namespace and veth pair used by --bench-netns"""
+    ns, (host_if, ns_if), (host_ip, ns_ip) = BENCH_NETNS, BENCH_VETH, BENCH_ADDRS
+    if not up:
+        # deleting the namespace takes the veth pair with it
+        subprocess.run(["ip", "netns", "del", ns], stderr=subprocess.DEVNULL)
+        return None
+    for cmd in (["ip", "netns", "add", ns],
+                ["ip", "link", "add", host_if, "type", "veth", "peer", "name", ns_if],
+                ["ip", "link", "set", ns_if, "netns", ns],
+                ["ip", "addr", "add", f"{host_ip}/24", "dev", host_if],
+                ["ip", "link", "set", host_if, "up"],
+                ["ip", "netns", "exec", ns, "ip", "addr", "add", f"{ns_ip}/24", "dev", ns_if],
+                ["ip", "netns", "exec", ns, "ip", "link", "set", ns_if, "up"],
+                ["ip", "netns", "exec", ns, "ip", "link", "set", "lo", "up"]):
+        subprocess.run(cmd, check=True)
+    log.log_info(f"Namespace {ns} ready: {host_ip} ({host_if}) <-> {ns_ip} ({ns_if})")
+
+
+def _bench_run(workdir: str, udp: bool, port: int, duration: int, engine: str,
+               clients: int, rate_kbps: int, size: int, batch: int, netns: bool) -> dict:
+    """One benchmark point: a server process plus 'clients' client processes"""
+    server_csv = os.path.join(workdir, "server.csv")
+    common = ['-p', str(port), '--sync-log', '--batch', str(batch)]
+    if udp:
+        common += ['-u', '-r', str(rate_kbps)]
+    server_args = ['-s', '-l', server_csv, '--engine', engine] + common
+    prefix = ["ip", "netns", "exec", BENCH_NETNS] if netns else []
+    host = BENCH_ADDRS[1] if netns else "127.0.0.1"
+
+    server = subprocess.Popen(prefix + _bench_cmd(*server_args),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    server_start = time.perf_counter()
+    time.sleep(BENCH_STARTUP)
+
+    client_csvs = [os.path.join(workdir, f"client{i}.csv") for i in range(clients)]
+    procs = [subprocess.Popen(_bench_cmd('-c', host, '-t', str(duration), '-l', path,
+                                         '--len', str(size), *common),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+             for path in client_csvs]
+    start = time.perf_counter()
+    client_cpu = sum(_bench_wait(proc) for proc in procs)
+    client_wall = time.perf_counter() - start
+
+    time.sleep(0.2)     # let the last datagrams and the termination packet land
+    server.send_signal(signal.SIGINT)
+    server_cpu = _bench_wait(server, BENCH_SHUTDOWN)
+    server_wall = time.perf_counter() - server_start
+
+    # clients log their send rate (the SUM row with -P)
+    sent = [_bench_mean(path, 'send_rate_mbps', ("", "SUM")) for path in client_csvs]
+    sent_mbps = sum(v for v in sent if v is not None) if any(v is not None for v in sent) else None
+    received_mbps = _bench_mean(server_csv, 'bandwidth_mbps')
+    target_mbps = rate_kbps * clients / 1000 if udp else None
+    loss = _bench_mean(server_csv, 'loss_percent') if udp else None   # summed over clients
+
+    def rounded(value):
+        return "" if value is None else round(value, 3)
+
+    return {
+        'proto': "udp" if udp else "tcp",
+        'engine': engine,
+        'clients': clients,
+        'rate_kbps': rate_kbps if udp else "",
+        'packet_size': size,
+        'netns': int(netns),
+        'target_mbps': rounded(target_mbps),
+        'sent_mbps': rounded(sent_mbps),
+        'received_mbps': rounded(received_mbps),
+        'achieved_percent': rounded(received_mbps / target_mbps * 100
+                                    if target_mbps and received_mbps is not None else None),
+        'loss_percent': rounded(loss / clients if loss is not None else None),
+        'server_cpu_percent': round(server_cpu / server_wall * 100, 1),
+        'client_cpu_percent': round(client_cpu / client_wall * 100, 1)
+    }
+
+
+def bench(log: Logger, output: str, udp: bool, port: int, duration: int,
+          rates: List[int], sizes: List[int], clients: List[int], engines: List[str],
+          batch: int = 1, netns: bool = False) -> None:
+    """Benchmark the tester against itself (--bench)
+    - Every combination of engine x clients x rate x size runs as separate
+      server and client processes of this script, over loopback or a veth pair
+    - Throughput comes from the processes' own CSV logs, CPU% from wait4 rusage
+      (client CPU is summed over all clients, so it can exceed 100)
+    - One row per run goes to 'output'
+    """
+    points = [(e, c, r, z) for e in engines for c in clients for r in rates for z in sizes]
+    log.log_info(f"Benchmarking {'UDP' if udp else 'TCP'}: {len(points)} runs of "
+                 f"{duration}s on {'a veth pair' if netns else 'loopback'} -> {output}")
+    if netns:
+        _bench_netns(log, False)    # leftovers from an interrupted run
+        _bench_netns(log, True)
+    try:
+        with open(output, "w", newline='') as f, tempfile.TemporaryDirectory() as workdir:
+            writer = csv.DictWriter(f, fieldnames=BENCH_FIELDS)
+            writer.writeheader()
+            for engine, count, rate, size in points:
+                row = _bench_run(workdir, udp, port, duration, engine, count, rate,
+                                 size, batch, netns)
+                writer.writerow(row)
+                f.flush()
+                log.log_info(f"{row['proto']} engine={engine} clients={count} "
+                             + (f"rate={rate}Kbps " if udp else "")
+                             + f"len={size}: sent {row['sent_mbps']} Mbps, "
+                               f"received {row['received_mbps']} Mbps"
+                             + (f" ({row['achieved_percent']}% of target, "
+                                f"loss {row['loss_percent']}%)" if udp else "")
+                             + f", CPU server {row['server_cpu_percent']}% "
+                               f"clients {row['client_cpu_percent']}%")
+    finally:
+        if netns:
+            _bench_netns(log, False)
+    log.log_success(f"Benchmark results saved to {output}")
+    return None
 
 
 if __name__ == "__main__":
@@ -775,6 +3778,11 @@ if __name__ == "__main__":
                       help="Run in server mode")
     mode.add_argument("-c", "--client", metavar="ADDR",
                       help="Run in client mode, connect to ADDR")
+    mode.add_argument("--membench", action="store_true",
+                      help="Measure memory per record and per client, then exit")
+    mode.add_argument("--bench", nargs="?", const="bench.csv", metavar="FILE",
+                      help="Run the loopback benchmark sweep (-u for UDP) and "
+                           "write one row per run to FILE (default bench.csv)")
 
     parser.add_argument("-p", "--port", type=int,
                         default=5001, help="Port (default 5001)")
@@ -790,25 +3798,180 @@ if __name__ == "__main__":
                         help="(UDP) send rate Kbps (default 1000)")
     parser.add_argument('-l', '--log', type=str, default=None,
                         help='Path to CSV log file (default: None)')
+    parser.add_argument("--log-format", choices=["csv", "bin"], default="csv",
+                        help="Format of the -l log file: CSV text or fixed-width binary "
+                             "records (default csv)")
+    parser.add_argument("--max-stats", type=int, default=None,
+                        help="Keep the latest this many records in memory (the summary "
+                             "doesn't need them; default: keep none)")
+    parser.add_argument("--compact-stats", action="store_true",
+                        help="With --max-stats, keep records in arrays instead of one "
+                             "object each")
+    parser.add_argument("--sync-log", action="store_true",
+                        help="Write log output on the calling thread instead of "
+                             "a background writer thread")
+    parser.add_argument("-P", "--parallel", type=int, default=1,
+                        help="(TCP client) number of parallel streams (default 1)")
+    parser.add_argument("--zerocopy", nargs="?", const="sendfile", choices=["sendfile", "msg"],
+                        default=None,
+                        help="(TCP client) transmit with sendfile (default) or MSG_ZEROCOPY")
+    parser.add_argument("-w", "--window", type=int, default=None,
+                        help="(TCP client) SO_SNDBUF size in bytes (default: OS)")
+    parser.add_argument("--len", type=int, default=None, dest="length",
+                        help="(Client) bytes per TCP send chunk (default 8192) "
+                             "or per UDP datagram (default 1472)")
+    parser.add_argument("-R", "--reverse", action="store_true",
+                        help="(Client) reverse mode: the server sends, the client receives")
+    parser.add_argument("--bidir", action="store_true",
+                        help="(Client) send and receive at the same time")
+    parser.add_argument("--control", action="store_true",
+                        help="(Client) negotiate the test with the server over TCP and "
+                             "fetch its interval reports at the end (with -R / --bidir "
+                             "also those of its sending side)")
+    parser.add_argument("--batch", type=int, default=1,
+                        help="(UDP) max datagrams per send/recv syscall (default 1)")
+    parser.add_argument("--rcvbuf", type=int, default=None,
+                        help="(UDP server) SO_RCVBUF size in bytes (default: OS)")
+    parser.add_argument("--sack", type=int, default=0, metavar="N",
+                        help="(UDP server, with -a) send one selective ACK per N datagrams "
+                             f"(at most {SACK_BITS}) instead of one ACK each")
+    parser.add_argument("--sack-ms", type=float, default=SACK_MS, metavar="T",
+                        help=f"(UDP server) ... or after T ms, whichever is first "
+                             f"(default {SACK_MS:g})")
+    parser.add_argument("--idle-timeout", type=float, default=UDP_IDLE_TIMEOUT, metavar="S",
+                        help="(UDP server) drop sessions silent for S seconds "
+                             f"(default {UDP_IDLE_TIMEOUT:g})")
+    parser.add_argument("--timestamps", choices=["kernel", "user"], default="kernel",
+                        help="(UDP server) receive times for jitter: kernel SO_TIMESTAMPNS "
+                             "(falls back to user if unsupported) or userspace clock "
+                             "(default kernel; the asyncio engine always uses user)")
+    parser.add_argument("--engine", choices=["default", "asyncio", "epoll"],
+                        default="default",
+                        help="(server) I/O engine: the blocking/select loops, asyncio, "
+                             "or epoll (TCP only) (default: default)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="(UDP server) worker processes sharing the port "
+                             "via SO_REUSEPORT (default 1)")
+
+    parser.add_argument("--daemon", nargs="?", const=METRICS_ADDR, default=None,
+                        metavar="ADDR",
+                        help="(server) long-running mode: serve Prometheus metrics on "
+                             f"ADDR, host:port or a Unix socket path (default {METRICS_ADDR}), "
+                             "and print only info / error lines")
+
+    parser.add_argument("--profile", action="store_true",
+                        help="Time the send/receive loop phases and report them every interval "
+                             "(not with --engine asyncio, its loop isn't ours)")
+    parser.add_argument("--profile-dump", metavar="FILE", default=None,
+                        help="Run under cProfile and save pstats data to FILE "
+                             "(view with: python -m pstats FILE)")
+    parser.add_argument("--bench-rates", type=_int_list, default=[10000, 100000, 500000],
+                        help="(Bench, UDP) comma separated rates in Kbps")
+    parser.add_argument("--bench-sizes", type=_int_list, default=None,
+                        help="(Bench) comma separated --len values "
+                             "(default 512,1472 for UDP, 8192,65536 for TCP)")
+    parser.add_argument("--bench-clients", type=_int_list, default=[1, 4],
+                        help="(Bench) comma separated concurrent client counts")
+    parser.add_argument("--bench-engines", type=lambda v: v.split(","), default=None,
+                        help="(Bench) comma separated server engines "
+                             "(default default,asyncio for UDP, default,epoll,asyncio for TCP)")
+    parser.add_argument("--bench-netns", action="store_true",
+                        help="(Bench) run the server in a network namespace behind "
+                             "a veth pair instead of on loopback (needs root and iproute2)")
 
     args = parser.parse_args()
-    log = Logger(csv_output=args.log)
-
-    if args.server:
-        if args.udp:
-            # Task 3/4 (no-op until implemented)
-            tester_udp_server(log, args.port, args.rate,
-                              args.interval, args.ack)
-        else:
-            # Task 2 (no-op until implemented)
-            tester_tcp_server(log, args.port)
+    if args.length is None:
+        args.length = UDP_PACKET_SIZE if args.udp else 8192
+    if args.udp and not _HEADER.size <= args.length <= UDP_PACKET_SIZE:
+        parser.error(f"--len for UDP must be between {_HEADER.size} and {UDP_PACKET_SIZE}")
+    direction = "bidir" if args.bidir else "reverse" if args.reverse else "forward"
+    if direction != "forward" and args.udp and args.ack:
+        parser.error("-R / --bidir can't be combined with -a")
+    if args.daemon and not args.server:
+        parser.error("--daemon is only for the server (-s)")
+    # CSV column groups this run can fill
+    columns = ["rate"]
+    if args.udp:
+        columns += ["udp", "delay"] if args.ack and not args.server else ["udp"]
     else:
-        if args.udp:
-            tester_udp_client(log, args.client, args.port,
-                              args.duration, args.interval,
-                              args.rate, args.ack)        # Task 3/4 (no-op until implemented)
+        columns.append("tcp")
+    if args.server:
+        columns.append("server")
+    log = Logger(csv_output=args.log, background=not args.sync_log,
+                 log_format=args.log_format, max_stats=args.max_stats,
+                 compact=args.compact_stats,
+                 profile_interval=args.interval if args.profile else None,
+                 per_client=not args.daemon, console=not args.daemon, columns=columns)
+    profiler = None
+    if args.profile_dump:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        if args.membench:
+            membench(log)
+        elif args.bench:
+            sizes = args.bench_sizes or ([512, UDP_PACKET_SIZE] if args.udp else [8192, 65536])
+            engines = args.bench_engines or (["default", "asyncio"] if args.udp
+                                             else ["default", "epoll", "asyncio"])
+            bench(log, args.bench, args.udp, args.port, args.duration,
+                  args.bench_rates if args.udp else [0], sizes, args.bench_clients,
+                  engines, args.batch, args.bench_netns)
+        elif args.server:
+            if args.daemon:
+                try:
+                    start_daemon(log, args.daemon, args.interval)
+                except (OSError, ValueError) as e:
+                    log.log_error(f"Can't serve metrics on {args.daemon}: {e}")
+                    sys.exit(1)
+
+                def _terminate(signum, frame):
+                    raise KeyboardInterrupt     # same clean stop as Ctrl-C
+                signal.signal(signal.SIGTERM, _terminate)
+            if args.engine == "asyncio":
+                tester_asyncio_server(log, args.port, args.udp, args.interval,
+                                      args.rate, args.ack, args.rcvbuf,
+                                      args.sack, args.sack_ms, args.idle_timeout)
+            elif args.udp:
+                # Task 3/4 (no-op until implemented)
+                if args.workers > 1:
+                    tester_udp_server_workers(log, args.port, args.rate, args.interval,
+                                              args.ack, args.workers, args.batch,
+                                              args.rcvbuf, args.timestamps == "kernel",
+                                              args.sack, args.sack_ms, args.idle_timeout)
+                else:
+                    tester_udp_server(log, args.port, args.rate,
+                                      args.interval, args.ack, args.batch, args.rcvbuf,
+                                      timestamps=args.timestamps == "kernel",
+                                      sack=args.sack, sack_ms=args.sack_ms,
+                                      idle_timeout=args.idle_timeout)
+            else:
+                # Task 2 (no-op until implemented)
+                if args.engine == "epoll":
+                    tester_tcp_server_epoll(log, args.port, args.interval)
+                else:
+                    tester_tcp_server(log, args.port, args.interval)
         else:
-            tester_tcp_client(log, args.client, args.port,
-                              args.duration, args.interval)  # Task 2 (no-op until implemented)
-    log.summary()
-    log.close()
+            if args.udp:
+                tester_udp_client(log, args.client, args.port,
+                                  args.duration, args.interval,
+                                  args.rate, args.ack, args.batch, args.length,
+                                  direction, args.control)  # Task 3/4 (no-op until implemented)
+            else:
+                tester_tcp_client(log, args.client, args.port,
+                                  args.duration, args.interval, args.parallel,
+                                  args.zerocopy, args.window, args.length,
+                                  direction, args.control)  # Task 2 (no-op until implemented)
+        if not (args.membench or args.bench):
+            log.summary()
+    except KeyboardInterrupt:   # the blocking servers only stop on Ctrl-C
+        log.log_info("Interrupted by user")
+        log.summary()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile_dump)
+            log.log_success(f"Profile saved to {args.profile_dump}")
+        if log.metrics is not None:
+            log.metrics.close()     # removes the --daemon Unix socket
+        log.close()     # flushes the background writer